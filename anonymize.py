@@ -1,7 +1,7 @@
 import argparse
 from os.path import isfile
 import sys
-from core.dblite import DBLite, MEMORY
+from core.dblite import DBLite, MEMORY, readonly_mode
 import logging
 from typing import Dict, List, Union, Tuple
 from collections import defaultdict
@@ -47,7 +47,7 @@ if __name__ == "__main__":
     str_values = set()
     num_values = set()
     to_anon: Dict[str, List[str]] = defaultdict(list)
-    with DBLite(pargs.db, readonly=True) as db:
+    with DBLite(pargs.db, readonly=readonly_mode(pargs.db)) as db:
         for table in db.tables:
             for col in db.get_cols(table):
                 if not is_to_anon(table, col):
@@ -68,7 +68,6 @@ if __name__ == "__main__":
     for table, cols in to_anon.items():
         cls = ", ".join(map(lambda c: f'"{c}"=mk_anon("{c}")', cols))
         SQL.append(f'UPDATE "{table}" SET {cls};')
-    SQL = "\n".join(SQL)
 
     str_values = tuple(sorted(str_values))
     num_len = len(num_values)
@@ -97,20 +96,18 @@ if __name__ == "__main__":
         return num_values_anom[v]
 
 
+    with DBLite(pargs.db, readonly=readonly_mode(pargs.db)) as s:
+        s.backup(out, vacuum=True)
     with DBLite(out) as db:
-        db.register_function("mk_anon", 1, mk_anon)
-        with DBLite(pargs.db, readonly=True) as s:
-            s.backup(db)
-        db.executescript(dedent(f'''
+        db.register_function("mk_anon", 1, mk_anon, deterministic=True, memoize=-1)
+        db.executescript(dedent('''
             PRAGMA foreign_keys = OFF;
             PRAGMA recursive_triggers = OFF;
-            PRAGMA synchronous = OFF;
-            PRAGMA journal_mode = OFF;
         '''))
-        db.executescript(SQL)
-        db.executescript(dedent(f'''
+        with db.bulk_load():
+            for sql in SQL:
+                db.execute(sql)
+        db.executescript(dedent('''
             PRAGMA foreign_keys = ON;
             PRAGMA recursive_triggers = ON;
-            PRAGMA synchronous = FULL;
-            PRAGMA journal_mode = DELETE; -- o WAL
         '''))
\ No newline at end of file
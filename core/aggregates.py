@@ -0,0 +1,300 @@
+from abc import ABC, abstractmethod
+from hashlib import blake2b
+from math import sqrt, log, asin, sin, pi
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Union
+
+MASK64 = (1 << 64) - 1
+
+
+def hash64(value: Any) -> int:
+    # hash() cambia en cada proceso, así los estados se pueden combinar entre ejecuciones
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bytes):
+        data = b"b" + value
+    elif isinstance(value, str):
+        data = b"s" + value.encode("utf-8", "surrogatepass")
+    else:
+        data = type(value).__name__[:1].encode() + repr(value).encode()
+    return int.from_bytes(blake2b(data, digest_size=8).digest(), "little")
+
+
+class Reducer(ABC):
+    def init(self) -> Any:
+        return None
+
+    @abstractmethod
+    def step(self, state: Any, value: Any) -> Any:
+        pass
+
+    @abstractmethod
+    def merge(self, state: Any, other: Any) -> Any:
+        pass
+
+    def finalize(self, state: Any) -> Any:
+        return state
+
+
+class Min(Reducer):
+    def step(self, state, value):
+        if state is None or value < state:
+            return value
+        return state
+
+    def merge(self, state, other):
+        if other is None:
+            return state
+        return self.step(state, other)
+
+
+class Max(Reducer):
+    def step(self, state, value):
+        if state is None or value > state:
+            return value
+        return state
+
+    def merge(self, state, other):
+        if other is None:
+            return state
+        return self.step(state, other)
+
+
+class First(Reducer):
+    def init(self):
+        return []
+
+    def step(self, state, value):
+        if len(state) == 0:
+            state.append(value)
+        return state
+
+    def merge(self, state, other):
+        return state or other
+
+    def finalize(self, state):
+        return state[0] if state else None
+
+
+class Last(Reducer):
+    def init(self):
+        return []
+
+    def step(self, state, value):
+        if state:
+            state[0] = value
+        else:
+            state.append(value)
+        return state
+
+    def merge(self, state, other):
+        return other or state
+
+    def finalize(self, state):
+        return state[0] if state else None
+
+
+class Mean(Reducer):
+    # Welford: [n, media, M2]
+    def init(self):
+        return [0, 0.0, 0.0]
+
+    def step(self, state, value):
+        n = state[0] + 1
+        delta = value - state[1]
+        mean = state[1] + delta / n
+        state[0] = n
+        state[1] = mean
+        state[2] += delta * (value - mean)
+        return state
+
+    def merge(self, state, other):
+        n_a, mean_a, m2_a = state
+        n_b, mean_b, m2_b = other
+        n = n_a + n_b
+        if n == 0:
+            return state
+        delta = mean_b - mean_a
+        state[0] = n
+        state[1] = mean_a + delta * n_b / n
+        state[2] = m2_a + m2_b + delta * delta * n_a * n_b / n
+        return state
+
+    def finalize(self, state):
+        if state[0] == 0:
+            return None
+        return state[1]
+
+
+class Variance(Mean):
+    def finalize(self, state):
+        if state[0] < 2:
+            return None
+        return state[2] / (state[0] - 1)
+
+
+class Stdev(Variance):
+    def finalize(self, state):
+        v = super().finalize(state)
+        if v is None:
+            return None
+        return sqrt(v)
+
+
+class TDigest:
+    def __init__(self, compression: int = 100):
+        self.compression = compression
+        self.means: List[float] = []
+        self.weights: List[float] = []
+        self.buffer: List[float] = []
+        self.count = 0
+
+    def add(self, value: float, weight: float = 1):
+        if weight == 1:
+            self.buffer.append(value)
+        else:
+            self.means.append(value)
+            self.weights.append(weight)
+        self.count = self.count + weight
+        if len(self.buffer) >= self.compression * 5:
+            self.compress()
+
+    def merge(self, other: "TDigest"):
+        self.means.extend(other.means)
+        self.weights.extend(other.weights)
+        self.buffer.extend(other.buffer)
+        self.count = self.count + other.count
+        self.compress()
+
+    def compress(self):
+        points = sorted(
+            list(zip(self.means, self.weights)) + [(v, 1) for v in self.buffer]
+        )
+        self.buffer = []
+        self.means = []
+        self.weights = []
+        if not points:
+            return
+        total = self.count
+        done = 0
+        limit = self.__q_limit(0)
+        mean, weight = points[0]
+        for m, w in points[1:]:
+            if (done + weight + w) / total <= limit:
+                weight = weight + w
+                mean = mean + (m - mean) * w / weight
+                continue
+            self.means.append(mean)
+            self.weights.append(weight)
+            done = done + weight
+            limit = self.__q_limit(done / total)
+            mean, weight = m, w
+        self.means.append(mean)
+        self.weights.append(weight)
+
+    def __q_limit(self, q: float):
+        # escala k1: k(q) = δ/2π · asin(2q - 1), cada centroide abarca como mucho 1 en k
+        k = self.compression * asin(2 * q - 1) / (2 * pi) + 1
+        if k >= self.compression / 4:
+            return 1
+        return (sin(k * 2 * pi / self.compression) + 1) / 2
+
+    def quantile(self, q: float) -> Union[None, float]:
+        if self.buffer:
+            self.compress()
+        if not self.means:
+            return None
+        if len(self.means) == 1:
+            return self.means[0]
+        target = q * self.count
+        done = 0
+        centers: List[float] = []
+        for w in self.weights:
+            centers.append(done + w / 2)
+            done = done + w
+        if target <= centers[0]:
+            return self.means[0]
+        if target >= centers[-1]:
+            return self.means[-1]
+        i = bisect_right(centers, target)
+        left, right = centers[i - 1], centers[i]
+        t = (target - left) / (right - left)
+        return self.means[i - 1] + t * (self.means[i] - self.means[i - 1])
+
+
+class Quantile(Reducer):
+    def __init__(self, q: float = 0.5, compression: int = 100):
+        self.q = q
+        self.compression = compression
+
+    def init(self):
+        return TDigest(self.compression)
+
+    def step(self, state: TDigest, value):
+        state.add(value)
+        return state
+
+    def merge(self, state: TDigest, other: TDigest):
+        state.merge(other)
+        return state
+
+    def finalize(self, state: TDigest):
+        return state.quantile(self.q)
+
+
+class Median(Quantile):
+    def __init__(self, compression: int = 100):
+        super().__init__(q=0.5, compression=compression)
+
+
+class ApproxDistinct(Reducer):
+    # HyperLogLog con 2^p registros
+    def __init__(self, p: int = 14):
+        self.p = p
+        self.m = 1 << p
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def init(self):
+        return bytearray(self.m)
+
+    def step(self, state: bytearray, value):
+        h = hash64(value)
+        i = h >> (64 - self.p)
+        rest = (h << self.p) & MASK64
+        rank = (64 - self.p + 1) if rest == 0 else (65 - rest.bit_length())
+        if rank > state[i]:
+            state[i] = rank
+        return state
+
+    def merge(self, state: bytearray, other: bytearray):
+        for i, r in enumerate(other):
+            if r > state[i]:
+                state[i] = r
+        return state
+
+    def finalize(self, state: bytearray):
+        estimate = self.alpha * self.m * self.m / sum(2.0 ** -r for r in state)
+        zeros = state.count(0)
+        if estimate <= 2.5 * self.m and zeros > 0:
+            estimate = self.m * log(self.m / zeros)
+        return int(round(estimate))
+
+
+REDUCERS: Dict[str, Reducer] = {
+    "mean": Mean(),
+    "variance": Variance(),
+    "stdev": Stdev(),
+    "first": First(),
+    "last": Last(),
+    "min_value": Min(),
+    "max_value": Max(),
+    "median": Median(),
+    "approx_distinct": ApproxDistinct(),
+}
+
+
+def reduce_states(reducer: Reducer, states: Iterable[Any]):
+    state = reducer.init()
+    for other in states:
+        state = reducer.merge(state, other)
+    return reducer.finalize(state)
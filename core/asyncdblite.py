@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import cycle
+from typing import Any, Callable, Dict, Tuple, Union
+
+from core.dblite import DBLite
+
+logger = logging.getLogger(__name__)
+
+
+class _Worker:
+    def __init__(self, factory: Callable[..., DBLite], args: Tuple, kwargs: Dict[str, Any]):
+        self.__factory = factory
+        self.__args = args
+        self.__kwargs = kwargs
+        self.__db: Union[None, DBLite] = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncDBLite")
+
+    @property
+    def db(self) -> DBLite:
+        if self.__db is None:
+            self.__db = self.__factory(*self.__args, **self.__kwargs)
+        return self.__db
+
+    def __call(self, fnc: Union[str, Callable], *args, **kwargs):
+        if isinstance(fnc, str):
+            return getattr(self.db, fnc)(*args, **kwargs)
+        return fnc(self.db, *args, **kwargs)
+
+    async def run(self, fnc: Union[str, Callable], *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(self.__call, fnc, *args, **kwargs))
+
+    def __close(self, *args, **kwargs):
+        if self.__db is not None:
+            self.__db.close(*args, **kwargs)
+            self.__db = None
+
+    async def close(self, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, partial(self.__close, *args, **kwargs))
+        self.executor.shutdown()
+
+
+class AsyncDBLite:
+    def __init__(self, *args, factory: Callable[..., DBLite] = DBLite, size: int = 1, **kwargs):
+        if size > 1 and not kwargs.get('readonly'):
+            raise ValueError(f"size={size} needs readonly=True")
+        self.__workers = tuple(_Worker(factory, args, kwargs) for _ in range(max(1, size)))
+        self.__next = cycle(self.__workers)
+
+    async def __aenter__(self, *args, **kwargs):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
+
+    async def run(self, fnc: Union[str, Callable], *args, **kwargs):
+        return await next(self.__next).run(fnc, *args, **kwargs)
+
+    async def select(self, sql: str, *args, row_factory=None, size: int = 1000):
+        worker: _Worker = next(self.__next)
+        cursor = await worker.run("_cursor", sql, *args, row_factory=row_factory)
+        try:
+            while True:
+                rows = await worker.run(lambda db: cursor.fetchmany(size))
+                if not rows:
+                    break
+                for r in rows:
+                    yield r
+        finally:
+            await worker.run(lambda db: cursor.close())
+
+    async def one(self, *args, **kwargs):
+        return await self.run("one", *args, **kwargs)
+
+    async def to_tuple(self, *args, **kwargs):
+        return await self.run("to_tuple", *args, **kwargs)
+
+    async def getkv(self, *args, **kwargs):
+        return await self.run("getkv", *args, **kwargs)
+
+    async def insert(self, *args, **kwargs):
+        return await self.run("insert", *args, **kwargs)
+
+    async def insert_many(self, *args, **kwargs):
+        return await self.run("insert_many", *args, **kwargs)
+
+    async def upsert_many(self, *args, **kwargs):
+        return await self.run("upsert_many", *args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await self.run("execute", *args, **kwargs)
+
+    async def executescript(self, *args, **kwargs):
+        return await self.run("executescript", *args, **kwargs)
+
+    async def commit(self):
+        for worker in self.__workers:
+            await worker.run("commit")
+
+    async def backup(self, *args, **kwargs):
+        return await self.run("backup", *args, **kwargs)
+
+    async def close(self, *args, **kwargs):
+        for worker in self.__workers:
+            await worker.close(*args, **kwargs)
@@ -0,0 +1,141 @@
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Dict, Tuple, Union
+
+
+@dataclass(frozen=True)
+class Column:
+    name: str
+    type: str
+    notnull: bool
+    default: Union[None, str]
+    pk: int
+
+
+@dataclass(frozen=True)
+class ForeignKey:
+    id: int
+    cols: Tuple[str, ...]
+    table: str
+    to: Tuple[Union[None, str], ...]
+
+
+@dataclass(frozen=True)
+class Index:
+    name: str
+    unique: bool
+    origin: str
+    cols: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class Table:
+    name: str
+    type: str
+    sql: Union[None, str]
+    columns: Tuple[Column, ...] = tuple()
+    foreign_keys: Tuple[ForeignKey, ...] = tuple()
+    indexes: Tuple[Index, ...] = tuple()
+
+    @property
+    def cols(self) -> Tuple[str, ...]:
+        return tuple(c.name for c in self.columns)
+
+    @property
+    def pk(self) -> Tuple[str, ...]:
+        pks = sorted((c.pk, c.name) for c in self.columns if c.pk > 0)
+        return tuple(name for _, name in pks)
+
+    def get_column(self, name: str) -> Union[None, Column]:
+        name = name.lower()
+        for c in self.columns:
+            if c.name.lower() == name:
+                return c
+        return None
+
+
+@dataclass(frozen=True)
+class Catalog:
+    schema_version: int
+    tables: Dict[str, Table] = field(default_factory=dict)
+
+    @staticmethod
+    def load(con: sqlite3.Connection) -> "Catalog":
+        schema_version = con.execute("PRAGMA schema_version").fetchone()[0]
+        master: Dict[str, Tuple[str, str]] = {}
+        columns: Dict[str, list] = {}
+        fks: Dict[str, Dict[int, list]] = {}
+        indexes: Dict[str, Dict[str, list]] = {}
+        for name, tp, sql in con.execute(
+            "SELECT name, type, sql FROM sqlite_master WHERE type in ('table', 'view') order by name"
+        ):
+            master[name] = (tp, sql)
+            columns[name] = []
+            fks[name] = {}
+            indexes[name] = {}
+        for table, cid, name, tp, notnull, dflt, pk in con.execute('''
+            SELECT m.name, p.cid, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master m JOIN pragma_table_info(m.name) p
+            WHERE m.type = 'table'
+            ORDER BY m.name, p.cid
+        '''):
+            columns[table].append(Column(name=name, type=tp, notnull=bool(notnull), default=dflt, pk=pk))
+        # una vista rota (p.e. sobre una tabla borrada) no puede estropear todo el catálogo
+        for view in [name for name, (tp, _) in master.items() if tp == 'view']:
+            try:
+                rows = con.execute('''
+                    SELECT p.name, p.type, p."notnull", p.dflt_value, p.pk
+                    FROM pragma_table_info(?) p ORDER BY p.cid
+                ''', (view, )).fetchall()
+            except sqlite3.OperationalError:
+                del master[view]
+                continue
+            for name, tp, notnull, dflt, pk in rows:
+                columns[view].append(Column(name=name, type=tp, notnull=bool(notnull), default=dflt, pk=pk))
+        for table, fid, ref, frm, to in con.execute('''
+            SELECT m.name, f.id, f."table", f."from", f."to"
+            FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f
+            WHERE m.type = 'table'
+            ORDER BY m.name, f.id, f.seq
+        '''):
+            fks[table].setdefault(fid, [ref, [], []])
+            fks[table][fid][1].append(frm)
+            fks[table][fid][2].append(to)
+        for table, name, unique, origin, col in con.execute('''
+            SELECT m.name, il.name, il."unique", il.origin, ii.name
+            FROM sqlite_master m
+            JOIN pragma_index_list(m.name) il
+            JOIN pragma_index_info(il.name) ii
+            WHERE m.type = 'table'
+            ORDER BY m.name, il.name, ii.seqno
+        '''):
+            indexes[table].setdefault(name, [bool(unique), origin, []])
+            indexes[table][name][2].append(col)
+
+        tables: Dict[str, Table] = {}
+        for name, (tp, sql) in master.items():
+            tables[name] = Table(
+                name=name,
+                type=tp,
+                sql=sql,
+                columns=tuple(columns[name]),
+                foreign_keys=tuple(
+                    ForeignKey(id=fid, table=ref, cols=tuple(frm), to=tuple(to))
+                    for fid, (ref, frm, to) in fks[name].items()
+                ),
+                indexes=tuple(
+                    Index(name=iname, unique=unique, origin=origin, cols=tuple(cols))
+                    for iname, (unique, origin, cols) in indexes[name].items()
+                )
+            )
+        return Catalog(schema_version=schema_version, tables=tables)
+
+    def get_table(self, name: str) -> Union[None, Table]:
+        table = self.tables.get(name)
+        if table is not None:
+            return table
+        name = name.lower()
+        for k, v in self.tables.items():
+            if k.lower() == name:
+                return v
+        return None
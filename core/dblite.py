@@ -2,11 +2,24 @@ from decimal import Decimal
 import os
 import sqlite3
 import errno
+import gzip
+import bz2
+import lzma
 from os.path import isfile
-from functools import cache
-import logging
-from typing import Dict, Tuple, Any, Union, List, Set, Callable
+from glob import glob, escape as glob_escape
 import re
+from functools import cache, partial, lru_cache
+from time import perf_counter
+from contextlib import contextmanager, closing
+from dataclasses import dataclass, field
+from collections import namedtuple
+import logging
+from typing import Dict, Tuple, Any, Union, List, Set, Callable, Iterable
+from core.tracer import SqlTracer
+from core.catalog import Catalog
+from core.aggregates import Reducer, REDUCERS, reduce_states
+from threading import local, Lock, Event
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +35,26 @@ def gW(arr: Union[List, Tuple, Set]):
     return f"={arr[0]}"
 
 
+# Equivalentes en SQL de str.isdigit() y del antiguo can_be_int() en Python,
+# con dos diferencias a propósito (ver tests/test_sql_checks.py):
+#  - solo cuentan los dígitos ASCII: '٣', '²' o '１２' no son enteros para
+#    SQLite (CAST('١' AS INTEGER) = 0) aunque str.isdigit() diga que sí
+#  - ±inf no es un entero (en Python int(inf) lanzaba OverflowError)
+def sql_isdigit(v: str):
+    return f"(typeof({v}) = 'text' AND {v} <> '' AND {v} NOT GLOB '*[^0-9]*')"
+
+
+def sql_can_be_int(v: str):
+    return (
+        f"(CASE typeof({v}) "
+        "WHEN 'null' THEN 1 "
+        "WHEN 'integer' THEN 1 "
+        f"WHEN 'real' THEN {v} = round({v}) AND abs({v}) < 9e999 "
+        f"WHEN 'text' THEN {v} <> '' AND {v} NOT GLOB '*[^0-9]*' "
+        "ELSE 0 END)"
+    )
+
+
 def mkAgregator(fnc: Callable):
     class MyAgregador:
         def __init__(self):
@@ -39,11 +72,75 @@ def mkAgregator(fnc: Callable):
     return MyAgregador
 
 
-def dict_factory(cursor: sqlite3.Cursor, row: Tuple):
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+def mkReducer(reducer: Reducer, stat: "FunctionStat", timed: bool = True):
+    class MyReducer:
+        def __init__(self):
+            self.state = reducer.init()
+
+        def step(self, valor, *args):
+            if valor is not None:
+                try:
+                    self.state = reducer.step(self.state, valor, *args)
+                except:
+                    logger.error(stat.name, exc_info=True)
+                    raise
+
+        def finalize(self):
+            start = perf_counter() if timed else 0
+            try:
+                return reducer.finalize(self.state)
+            except:
+                logger.error(stat.name, exc_info=True)
+                raise
+            finally:
+                if timed:
+                    stat.calls = stat.calls + 1
+                    stat.time = stat.time + (perf_counter() - start)
+
+    return MyReducer
+
+
+class CursorFactory:
+    def __init__(self, build: Callable[[Tuple], Union[None, Callable]]):
+        self.build = build
+
+    def __call__(self, cursor: sqlite3.Cursor, row: Tuple):
+        fnc = self.build(cursor.description)
+        if fnc is None:
+            return row
+        return fnc(cursor, row)
+
+    @staticmethod
+    def get(cursor: sqlite3.Cursor, row_factory: Union[None, Callable]):
+        if isinstance(row_factory, CursorFactory):
+            return row_factory.build(cursor.description or tuple())
+        return row_factory
+
+
+def _build_dict_factory(description: Tuple):
+    cols = tuple(col[0] for col in description)
+
+    def factory(cursor: sqlite3.Cursor, row: Tuple):
+        return dict(zip(cols, row))
+    return factory
+
+
+@cache
+def _get_namedtuple(cols: Tuple[str, ...]):
+    return namedtuple("Row", cols, rename=True)
+
+
+def _build_namedtuple_factory(description: Tuple):
+    make = _get_namedtuple(tuple(col[0] for col in description))._make
+
+    def factory(cursor: sqlite3.Cursor, row: Tuple):
+        return make(row)
+    return factory
+
+
+dict_factory = CursorFactory(_build_dict_factory)
+namedtuple_factory = CursorFactory(_build_namedtuple_factory)
+tuple_factory = CursorFactory(lambda description: None)
 
 
 def ResultIter(cursor: sqlite3.Cursor, size: int = 1000):
@@ -55,6 +152,194 @@ def ResultIter(cursor: sqlite3.Cursor, size: int = 1000):
             yield result
 
 
+def get_affinity(decltype: Union[None, str]):
+    decltype = (decltype or "").upper()
+    if "INT" in decltype:
+        return "INTEGER"
+    if "CHAR" in decltype or "CLOB" in decltype or "TEXT" in decltype:
+        return "TEXT"
+    if len(decltype) == 0 or "BLOB" in decltype:
+        return "BLOB"
+    if "REAL" in decltype or "FLOA" in decltype or "DOUB" in decltype:
+        return "REAL"
+    return "NUMERIC"
+
+
+def _infer_kind(values: Tuple):
+    types = set(map(type, values))
+    types.discard(type(None))
+    if len(types) == 0:
+        return None
+    if types.issubset((int, )):
+        return "INTEGER"
+    if types.issubset((int, float)):
+        return "REAL"
+    return "TEXT"
+
+
+def _to_masked_array(data, affinity: Union[None, str]):
+    import numpy as np
+
+    kind = _infer_kind(data)
+    if kind is None:
+        kind = affinity
+    elif kind == "INTEGER" and affinity == "REAL":
+        kind = "REAL"
+    dtype = {"INTEGER": np.int64, "REAL": np.float64}.get(kind, object)
+    mask = np.equal(data, None)
+    if not mask.any():
+        mask = np.ma.nomask
+    if dtype is not object:
+        try:
+            if mask is not np.ma.nomask:
+                data[mask] = 0
+            data = data.astype(dtype)
+        except OverflowError:
+            pass
+    return np.ma.MaskedArray(data, mask=mask)
+
+
+COMPRESS = {
+    "gz": partial(gzip.open, compresslevel=6),
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+
+def open_sql(file: str, mode: str = "r"):
+    ext = file.rsplit(".", 1)[-1].lower()
+    if ext in COMPRESS:
+        return COMPRESS[ext](file, mode + "t")
+    return open(file, mode)
+
+
+re_sql_token = re.compile(r"[;'\"`\[]|--|/\*")
+re_sql_trigger = re.compile(r"^(?:\s+|--[^\n]*\n|/\*.*?\*/)*CREATE\s+(?:TEMP\s+|TEMPORARY\s+)?TRIGGER\b", re.I | re.S)
+SQL_CLOSE = {"'": "'", '"': '"', "`": "`", "[": "]", "--": "\n", "/*": "*/"}
+
+
+# Localiza el final de las sentencias de un script SQL que se lee por trozos,
+# recordando si hay una cadena o un comentario abierto, sin guardar el texto
+# ya leído (salvo en los CREATE TRIGGER, cuyo cuerpo lleva ; propios)
+class SqlSplitter:
+    def __init__(self):
+        self.__close: Union[None, str] = None
+        self.__head = ""
+        self.__trigger: Union[None, List[str]] = None
+
+    def split(self, text: str):
+        # posiciones de text justo después de cada ; que cierra una sentencia
+        start = 0
+        pos = 0
+        while True:
+            if self.__close is not None:
+                i = text.find(self.__close, pos)
+                if i < 0:
+                    break
+                pos = i + len(self.__close)
+                self.__close = None
+                continue
+            m = re_sql_token.search(text, pos)
+            if m is None:
+                break
+            pos = m.end()
+            if m.group() != ";":
+                self.__close = SQL_CLOSE[m.group()]
+                continue
+            if self.__is_end(text[start:pos]):
+                yield pos
+            start = pos
+        self.__append(text[start:])
+
+    def __append(self, text: str):
+        if self.__trigger is not None:
+            self.__trigger.append(text)
+        elif len(self.__head) < 256:
+            head = self.__head + text
+            if re_sql_trigger.match(head):
+                self.__trigger = [head]
+            self.__head = head[:256]
+
+    def __is_end(self, text: str):
+        self.__append(text)
+        if self.__trigger is not None:
+            sql = "".join(self.__trigger)
+            if not sqlite3.complete_statement(sql):
+                self.__trigger = [sql]
+                return False
+        self.__head = ""
+        self.__trigger = None
+        return True
+
+
+def write_sql(name: str, lines: Iterable[str], compress: Union[None, str] = None, part_size: int = -1) -> Tuple[str, ...]:
+    ext = ".sql" + ("." + compress if compress else "")
+    if compress and compress not in COMPRESS:
+        raise ValueError("compress must be: " + ", ".join(COMPRESS.keys()))
+    if part_size <= 0:
+        with open_sql(name + ext, "w") as f:
+            for line in lines:
+                f.write(line+"\n")
+        return (name + ext, )
+    files: List[str] = []
+    f = None
+    size = 0
+    # solo se corta entre sentencias completas (un ; puede estar dentro
+    # de un trigger o de un texto de varias líneas)
+    splitter = SqlSplitter()
+    try:
+        for line in lines:
+            if f is None:
+                files.append(f"{name}.part{len(files) + 1:03d}{ext}")
+                f = open_sql(files[-1], "w")
+                size = 0
+            f.write(line+"\n")
+            size = size + len(line) + 1
+            end = None
+            for end in splitter.split(line + "\n"):
+                pass
+            if end is not None and size >= part_size and len(line[end:].strip()) == 0:
+                f.close()
+                f = None
+    finally:
+        if f is not None:
+            f.close()
+    return tuple(files)
+
+
+re_sql_part = re.compile(r"^(.+?)((?:\.part\d{3,})+)\.sql(?:\.(?:gz|bz2|xz))?$")
+
+
+def find_sql_parts(file: str) -> Tuple[str, ...]:
+    m = re_sql_part.match(file)
+    if m is None:
+        return (file, )
+    prefix = m.group(1)
+    parts: List[Tuple[Tuple[int, ...], str]] = []
+    for f in glob(glob_escape(prefix) + ".part*.sql*"):
+        p = re_sql_part.match(f)
+        if p is None or p.group(1) != prefix:
+            continue
+        parts.append((tuple(int(n) for n in p.group(2).split(".part")[1:]), f))
+    return tuple(f for _, f in sorted(parts))
+
+
+def iter_sql_statements(lines: Iterable[str]):
+    splitter = SqlSplitter()
+    buffer: List[str] = []
+    for line in lines:
+        start = 0
+        for end in splitter.split(line):
+            buffer.append(line[start:end])
+            start = end
+            yield "".join(buffer)
+            buffer = []
+        buffer.append(line[start:])
+    sql = "".join(buffer)
+    if len(sql.strip()) > 0:
+        yield sql
+
+
 class DBLiteException(sqlite3.OperationalError):
     pass
 
@@ -67,7 +352,118 @@ class SqlException(DBLiteException):
     pass
 
 
+class BackupCancelled(DBLiteException):
+    pass
+
+
 MEMORY = ":memory:"
+IMMUTABLE = "immutable"
+IMMUTABLE_CACHE_MB = 64
+
+
+def readonly_mode(file: str) -> Union[bool, str]:
+    if isfile(file) and not os.access(file, os.W_OK):
+        return IMMUTABLE
+    return True
+
+
+@dataclass
+class FunctionStat:
+    name: str
+    calls: int = 0
+    time: float = 0
+    cache: Union[None, Callable] = field(default=None, repr=False)
+
+    @property
+    def hits(self) -> int:
+        if self.cache is None:
+            return 0
+        return self.cache.cache_info().hits
+
+    @property
+    def misses(self) -> int:
+        if self.cache is None:
+            return self.calls
+        return self.cache.cache_info().misses
+
+
+@dataclass(frozen=True)
+class Maintenance:
+    integrity_check: str = "full"
+    foreign_key_check: bool = True
+    vacuum: str = "full"
+    min_freelist_ratio: float = 0
+    analyze: bool = False
+    optimize: bool = False
+    only_if_changed: bool = True
+
+    def __post_init__(self):
+        if self.integrity_check not in ("none", "quick", "full"):
+            raise ValueError(f"integrity_check must be none, quick or full, but got '{self.integrity_check}'")
+        if self.vacuum not in ("none", "incremental", "full"):
+            raise ValueError(f"vacuum must be none, incremental or full, but got '{self.vacuum}'")
+
+
+@dataclass(frozen=True)
+class BackupProgress:
+    total: int
+    remaining: int
+    elapsed: float
+
+    @property
+    def copied(self) -> int:
+        return self.total - self.remaining
+
+    @property
+    def ratio(self) -> float:
+        if self.total == 0:
+            return 1
+        return self.copied / self.total
+
+    @property
+    def eta(self) -> Union[None, float]:
+        if self.copied == 0:
+            return None
+        return self.elapsed * self.remaining / self.copied
+
+
+class BackupHandle:
+    def __init__(self, fnc: Callable[["BackupHandle"], Any]):
+        self.progress: Union[None, BackupProgress] = None
+        self.__cancel = Event()
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="DBLiteBackup")
+        self.__future = executor.submit(fnc, self)
+        executor.shutdown(wait=False)
+
+    def _on_progress(self, progress: BackupProgress):
+        self.progress = progress
+        if self.__cancel.is_set():
+            raise BackupCancelled("backup cancelado")
+
+    def cancel(self):
+        self.__cancel.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.__cancel.is_set()
+
+    @property
+    def done(self) -> bool:
+        return self.__future.done()
+
+    @property
+    def eta(self) -> Union[None, float]:
+        if self.progress is None:
+            return None
+        return self.progress.eta
+
+    def result(self, timeout: Union[None, float] = None):
+        return self.__future.result(timeout)
+
+
+NO_MAINTENANCE = Maintenance(integrity_check="none", foreign_key_check=False, vacuum="none")
+QUICK_MAINTENANCE = Maintenance(integrity_check="quick", foreign_key_check=False, vacuum="full", min_freelist_ratio=0.25, optimize=True)
+FULL_MAINTENANCE = Maintenance()
 
 
 class DBLite:
@@ -91,23 +487,40 @@ class DBLite:
             self,
             file: str = MEMORY,
             extensions: Union[None, Tuple] = None,
-            readonly: bool = False,
+            readonly: Union[bool, str] = False,
             trim_str: bool = True,
             empty_is_null: bool = True,
-            commit_every_x_changes: int = 1000
+            commit_every_x_changes: int = 1000,
+            check_same_thread: bool = True,
+            maintenance: Maintenance = FULL_MAINTENANCE,
+            stats: bool = False
     ):
+        if readonly not in (True, False, IMMUTABLE):
+            raise ValueError(f"readonly must be True, False or '{IMMUTABLE}', but got {readonly!r}")
         self.__readonly = readonly
+        self.__check_same_thread = check_same_thread
         self.__extensions = extensions or tuple()
         self.__inTransaction = False
+        self.__bulk_load = False
         self.__changes = 0
         self.__trim_str = trim_str
         self.__empty_is_null = empty_is_null
         self.__commit_every_x_changes = commit_every_x_changes
+        self.__catalog: Union[None, Catalog] = None
+        self.__cols: Dict[str, Tuple[str, ...]] = {}
+        self.__insert_sql: Dict[Tuple, str] = {}
+        self.__insert_keys: Dict[Tuple[str, Tuple], Tuple[Tuple[str, ...], Tuple]] = {}
+        self.__maintenance = maintenance
+        self.__tracer: Union[None, SqlTracer] = None
+        self.__stats = stats
+        self.__function_stats: Dict[str, FunctionStat] = {}
         self._con = self.__get__connection(file)
+        self.__total_changes = self._con.total_changes
+        self.__schema_version = self.schema_version
 
     @property
     def file(self):
-        for name, file in self.select("PRAGMA database_list"):
+        for _, name, file in self.select("PRAGMA database_list"):
             if name == "main":
                 return file
 
@@ -133,10 +546,15 @@ class DBLite:
         return con
 
     def _connect(self, file: str):
+        if self.__readonly == IMMUTABLE:
+            con = sqlite3.connect("file:" + file + "?mode=ro&immutable=1", uri=True, check_same_thread=self.__check_same_thread)
+            con.execute(f"PRAGMA mmap_size={os.path.getsize(file)}")
+            con.execute(f"PRAGMA cache_size={-IMMUTABLE_CACHE_MB * 1024}")
+            return con
         if self.__readonly:
             file = "file:" + file + "?mode=ro"
-            return sqlite3.connect(file, uri=True)
-        return sqlite3.connect(file)
+            return sqlite3.connect(file, uri=True, check_same_thread=self.__check_same_thread)
+        return sqlite3.connect(file, check_same_thread=self.__check_same_thread)
 
     def __enter__(self, *args, **kwargs):
         return self
@@ -149,78 +567,351 @@ class DBLite:
             mpt.backup(self._con)
 
     def openTransaction(self):
-        if self.__inTransaction:
+        if self.__inTransaction and self._con.in_transaction:
             self._con.execute("END TRANSACTION")
         self._con.execute("BEGIN TRANSACTION")
         self.__inTransaction = True
 
     def closeTransaction(self):
         if self.__inTransaction:
-            self._con.execute("END TRANSACTION")
+            if self._con.in_transaction:
+                self._con.execute("END TRANSACTION")
+            self.__inTransaction = False
+
+    @contextmanager
+    def bulk_load(self, cache_mb: int = 256, mmap_mb: int = 0, defer_fk: bool = True):
+        if self.__readonly:
+            raise DBLiteException(f"bulk_load and readonly={self.__readonly} doesn't make sense")
+        if self.__bulk_load:
+            yield self
+            return
+        self.closeTransaction()
+        self._con.commit()
+        profile = dict(
+            journal_mode="MEMORY",
+            synchronous="OFF",
+            cache_size=-cache_mb * 1024,
+            temp_store="MEMORY",
+            locking_mode="EXCLUSIVE",
+        )
+        if mmap_mb > 0:
+            profile["mmap_size"] = mmap_mb * 1024 * 1024
+        snapshot = {k: self.one(f"PRAGMA {k}") for k in profile.keys()}
+        for k, v in profile.items():
+            self._con.execute(f"PRAGMA {k}={v}")
+        self.openTransaction()
+        if defer_fk:
+            self._con.execute("PRAGMA defer_foreign_keys=ON")
+        self.__bulk_load = True
+        try:
+            yield self
+        except BaseException:
             self.__inTransaction = False
+            self._con.rollback()
+            raise
+        else:
+            self.closeTransaction()
+            self._con.commit()
+        finally:
+            self.__bulk_load = False
+            for k, v in snapshot.items():
+                self._con.execute(f"PRAGMA {k}={v}")
+            self.one("SELECT count(*) FROM sqlite_master")
+            self.clear_cache()
+
+    def start_trace(self, threshold: float = 1.0, log: Union[None, str] = None, progress_steps: int = 1000) -> SqlTracer:
+        self.stop_trace()
+        self.__tracer = SqlTracer(self._con, threshold=threshold, log=log, progress_steps=progress_steps)
+        return self.__tracer
+
+    def stop_trace(self) -> Union[None, SqlTracer]:
+        tracer = self.__tracer
+        if tracer is not None:
+            tracer.close()
+            self.__tracer = None
+        return tracer
+
+    @property
+    def tracer(self) -> Union[None, SqlTracer]:
+        return self.__tracer
 
     def execute(self, sql: str):
+        token = self.__tracer.start() if self.__tracer else None
         try:
             self._con.execute(sql)
         except sqlite3.OperationalError as e:
             raise SqlException(sql) from e
-        self._con.commit()
-        self.clear_cache()
+        if token:
+            self.__tracer.end(token, sql)
+        self.commit()
+        self.__check_schema()
 
     def executescript(self, sql: str):
+        token = self.__tracer.start() if self.__tracer else None
         try:
             self._con.executescript(sql)
         except sqlite3.OperationalError as e:
             raise SqlException(sql) from e
-        self._con.commit()
-        self.clear_cache()
+        if token:
+            self.__tracer.end(token, sql, explain=False)
+        if self.__bulk_load:
+            if not self._con.in_transaction:
+                self.openTransaction()
+        else:
+            self._con.commit()
+        self.__check_schema()
 
     def clear_cache(self):
-        self.get_cols.cache_clear()
-        self.get_sql_table.cache_clear()
+        self.__catalog = None
+        self.__cols.clear()
+        self.__insert_sql.clear()
+        self.__insert_keys.clear()
+
+    def __check_schema(self):
+        if self.__catalog is None and len(self.__cols) == 0:
+            return
+        if self.__catalog is not None and self.__catalog.schema_version == self.schema_version:
+            return
+        self.clear_cache()
+
+    def __get_catalog(self) -> Catalog:
+        if self.__catalog is None:
+            self.__catalog = Catalog.load(self._con)
+        return self.__catalog
+
+    @property
+    def catalog(self) -> Catalog:
+        if self.__catalog is not None and self.__catalog.schema_version != self.schema_version:
+            self.clear_cache()
+        return self.__get_catalog()
 
     @property
     def tables(self) -> Tuple[str]:
-        return self.to_tuple("SELECT name FROM sqlite_master WHERE type='table' order by name")
+        return tuple(
+            t.name for t in self.catalog.tables.values()
+            if t.type == 'table' and not t.name.lower().startswith("sqlite_")
+        )
 
     @property
     def indices(self):
         return self.to_tuple("SELECT name FROM sqlite_master WHERE type='index' order by name")
 
-    @cache
     def get_sql_table(self, table: str):
-        return self.one("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", table)
+        t = self.__get_catalog().get_table(table)
+        if t is None or t.type != 'table':
+            return None
+        return t.sql
 
-    @cache
     def get_cols(self, sql: str) -> Tuple[str]:
+        cols = self.__cols.get(sql)
+        if cols is not None:
+            return cols
+        t = self.__get_catalog().get_table(sql)
+        if t is not None:
+            self.__cols[sql] = t.cols
+            return t.cols
         _sql = sql.lower().split()
         if len(_sql) == 1:
-            sql = f"select * from {sql} limit 0"
+            _sql = f"select * from {sql} limit 0"
         elif _sql[-1] != "limit":
-            sql = sql + " limit 0"
+            _sql = sql + " limit 0"
+        else:
+            _sql = sql
         cursor = self._con.cursor()
-        cursor.execute(sql)
+        cursor.execute(_sql)
         cols = tuple(col[0] for col in cursor.description)
         cursor.close()
+        self.__cols[sql] = cols
         return cols
 
-    def insert(self, table: str, insert_or="", **kwargs):
+    @staticmethod
+    def __format_insert_or(insert_or: str):
         insert_or = (insert_or or "").strip()
         if len(insert_or) > 0:
             insert_or = (" or "+insert_or).upper()
+        return insert_or
+
+    def __get_insert_sql(self, table: str, insert_or: str, cols: Tuple[str, ...], conflict: Union[None, Tuple] = None):
+        key = (table, insert_or, cols, conflict)
+        sql = self.__insert_sql.get(key)
+        if sql is None:
+            keys = ", ".join('"' + k + '"' for k in cols)
+            prm = ", ".join(['?'] * len(cols))
+            sql = f"INSERT{insert_or} INTO {table} ({keys}) VALUES ({prm})"
+            if conflict is not None:
+                sql = sql + DBLite.__format_on_conflict(cols, *conflict)
+            self.__insert_sql[key] = sql
+        return sql
+
+    @staticmethod
+    def __format_on_conflict(cols: Tuple[str, ...], conflict_cols: Tuple[str, ...], update_cols: Union[None, Tuple[str, ...]]):
+        names = {c.lower(): c for c in cols}
+        conflict = set(c.lower() for c in conflict_cols)
+        if update_cols is None:
+            update_cols = tuple(c for c in cols if c.lower() not in conflict)
+        for c in update_cols:
+            if c.lower() not in names:
+                raise EmptyUpSertException(f"upsert malformed: update column {c} not in {cols}")
+        update_cols = tuple(names[c.lower()] for c in update_cols)
+        cnf = ", ".join('"' + k + '"' for k in conflict_cols)
+        if len(update_cols) == 0:
+            return f" ON CONFLICT ({cnf}) DO NOTHING"
+        updt = ", ".join(f'"{k}" = excluded."{k}"' for k in update_cols)
+        return f" ON CONFLICT ({cnf}) DO UPDATE SET {updt}"
+
+    def insert(self, table: str, insert_or="", **kwargs):
+        insert_or = DBLite.__format_insert_or(insert_or)
 
         data = self.__sanitize_row(table, kwargs, skip_null=True)
 
-        keys = []
-        vals = []
-        for k, v in data.items():
-            keys.append('"' + k + '"')
-            vals.append(v)
+        keys = tuple(data.keys())
+        vals = tuple(data.values())
 
-        prm = ['?'] * len(vals)
-        sql = f"INSERT{insert_or} INTO {table} ({', '.join(tuple(keys))}) VALUES ({', '.join(tuple(prm))})"
+        sql = self.__get_insert_sql(table, insert_or, keys)
         self.run_modify_query(sql, *vals)
 
+    def __get_insert_keys(self, table: str, keys: Tuple):
+        shape = self.__insert_keys.get((table, keys))
+        if shape is not None:
+            return shape
+        ok_keys = tuple(k.lower() for k in self.get_cols(table))
+        data: Dict[str, Any] = {}
+        for k in keys:
+            col = k.lower()
+            if col in ok_keys:
+                data[col] = k
+        if len(data) == 0:
+            raise EmptyUpSertException(f"upsert into {table} malformed: give {keys}, needed {ok_keys}")
+        shape = (tuple(data.keys()), tuple(data.values()))
+        self.__insert_keys[(table, keys)] = shape
+        return shape
+
+    def __check_cols(self, table: str, cols: Union[None, Tuple[str, ...]]):
+        ok_cols = self.get_cols(table)
+        if cols is None:
+            return ok_cols
+        cols = tuple(c.lower() for c in cols)
+        ok_keys = tuple(c.lower() for c in ok_cols)
+        for c in cols:
+            if c not in ok_keys:
+                raise EmptyUpSertException(f"upsert into {table} malformed: give {cols}, needed {ok_keys}")
+        return cols
+
+    def insert_many(
+            self,
+            table: str,
+            rows: Iterable[Union[Dict[str, Any], Tuple]],
+            insert_or="",
+            cols: Union[None, Tuple[str, ...]] = None,
+            chunk_size: int = 1000,
+            skip_null: bool = True
+    ):
+        # como en insert, con skip_null los valores NULL (y los '' si empty_is_null)
+        # no se insertan, para que se apliquen los DEFAULT de la tabla, y el lote
+        # se corta cada vez que cambian las columnas con valor; con skip_null=False
+        # se insertan NULL explícitos sin cortar el lote
+        insert_or = DBLite.__format_insert_or(insert_or)
+        cols = self.__check_cols(table, cols)
+        return self.__insert_many(table, rows, cols, chunk_size, skip_null, insert_or)
+
+    def upsert_many(
+            self,
+            table: str,
+            rows: Iterable[Union[Dict[str, Any], Tuple]],
+            conflict_cols: Tuple[str, ...],
+            update_cols: Union[None, Tuple[str, ...]] = None,
+            cols: Union[None, Tuple[str, ...]] = None,
+            chunk_size: int = 1000,
+            skip_null: bool = True
+    ):
+        # con skip_null una columna NULL en una fila no se inserta ni se actualiza
+        if isinstance(conflict_cols, str):
+            conflict_cols = (conflict_cols, )
+        if isinstance(update_cols, str):
+            update_cols = (update_cols, )
+        if len(conflict_cols) == 0:
+            raise EmptyUpSertException(f"upsert into {table} malformed: conflict_cols is empty")
+        conflict_cols = self.__check_cols(table, conflict_cols)
+        if update_cols is not None:
+            update_cols = self.__check_cols(table, update_cols)
+        cols = self.__check_cols(table, cols)
+        return self.__insert_many(table, rows, cols, chunk_size, skip_null, "", (conflict_cols, update_cols))
+
+    def __insert_many(
+            self,
+            table: str,
+            rows: Iterable[Union[Dict[str, Any], Tuple]],
+            cols: Tuple[str, ...],
+            chunk_size: int,
+            skip_null: bool,
+            insert_or: str,
+            conflict: Union[None, Tuple] = None
+    ):
+        sanitize = self.__sanitize_value
+        last_keys = None
+        row_cols = cols
+        picks = None
+        last_shape = None
+        sql = None
+        batch: List[Tuple] = []
+        count = 0
+        for row in rows:
+            if isinstance(row, dict):
+                keys = tuple(row.keys())
+                if keys != last_keys:
+                    last_keys = keys
+                    row_cols, picks = self.__get_insert_keys(table, keys)
+                vals = tuple(sanitize(row[k]) for k in picks)
+            else:
+                if len(row) != len(cols):
+                    raise EmptyUpSertException(f"upsert into {table} malformed: give {row}, needed {cols}")
+                keys = None
+                row_cols = cols
+                vals = tuple(map(sanitize, row))
+            mask = None
+            if skip_null and None in vals:
+                mask = tuple(v is not None for v in vals)
+                vals = tuple(v for v in vals if v is not None)
+            shape = (keys, mask)
+            if shape != last_shape or sql is None:
+                count = count + self.__run_modify_many(sql, batch)
+                batch = []
+                last_shape = shape
+                sql = self.__get_insert_many_sql(table, insert_or, row_cols, mask, conflict, row)
+            batch.append(vals)
+            if len(batch) >= chunk_size:
+                count = count + self.__run_modify_many(sql, batch)
+                batch = []
+        count = count + self.__run_modify_many(sql, batch)
+        return count
+
+    def __get_insert_many_sql(self, table: str, insert_or: str, cols: Tuple[str, ...], mask: Union[None, Tuple[bool, ...]], conflict: Union[None, Tuple], row):
+        if mask is None:
+            return self.__get_insert_sql(table, insert_or, cols, conflict)
+        if conflict is not None:
+            # los errores en update_cols se dan con las columnas de la fila, no con las que tienen valor
+            DBLite.__format_on_conflict(cols, *conflict)
+        cols = tuple(c for c, m in zip(cols, mask) if m)
+        if len(cols) == 0:
+            raise EmptyUpSertException(f"upsert into {table} malformed: give {row}, all values are null")
+        if conflict is not None and conflict[1] is not None:
+            kept = set(c.lower() for c in cols)
+            conflict = (conflict[0], tuple(c for c in conflict[1] if c.lower() in kept))
+        return self.__get_insert_sql(table, insert_or, cols, conflict)
+
+    def __run_modify_many(self, sql: str, vals: List[Tuple]):
+        if len(vals) == 0:
+            return 0
+        token = self.__tracer.start() if self.__tracer else None
+        try:
+            self._con.executemany(sql, vals)
+            self.__change_occurred(len(vals))
+        except sqlite3.OperationalError as e:
+            raise EmptyUpSertException(sql) from e
+        if token:
+            self.__tracer.end(token, sql, vals[0])
+        return len(vals)
+
     def update(self, table: str, where: Union[None, Dict[str, Any]], **kwargs):
         data = self.__sanitize_row(table, kwargs, skip_null=False)
         if where:
@@ -247,20 +938,23 @@ class DBLite:
         self.run_modify_query(sql, *vals)
 
     def run_modify_query(self, sql: str, *vals):
+        token = self.__tracer.start() if self.__tracer else None
         try:
             self._con.execute(sql, vals)
             self.__change_occurred()
         except sqlite3.OperationalError as e:
             sql = DBLite.__format_sql(sql, vals)
             raise EmptyUpSertException(sql) from e
+        if token:
+            self.__tracer.end(token, sql, vals)
 
-    def __change_occurred(self):
-        self.__changes = self.__changes + 1
+    def __change_occurred(self, changes: int = 1):
+        self.__changes = self.__changes + changes
         if self.__commit_every_x_changes < 0:
             return False
-        if self.__changes % self.__commit_every_x_changes != 0:
+        if (self.__changes // self.__commit_every_x_changes) == ((self.__changes - changes) // self.__commit_every_x_changes):
             return False
-        self._con.commit()
+        self.commit()
         return True
 
     def __sanitize_row(self, table: str, kwargs: Dict[str, Any], skip_null=False):
@@ -270,13 +964,7 @@ class DBLite:
             k = k.lower()
             if k not in ok_keys:
                 continue
-            if isinstance(v, str):
-                if self.__trim_str:
-                    v = v.strip()
-                if self.__empty_is_null and len(v) == 0:
-                    v = None
-            if isinstance(v, Decimal):
-                v = float(v)
+            v = self.__sanitize_value(v)
             if skip_null and v is None:
                 continue
             data[k] = v
@@ -286,9 +974,33 @@ class DBLite:
 
         return data
 
+    def __sanitize_value(self, v: Any):
+        if isinstance(v, str):
+            if self.__trim_str:
+                v = v.strip()
+            if self.__empty_is_null and len(v) == 0:
+                v = None
+        elif isinstance(v, Decimal):
+            v = float(v)
+        return v
+
     def commit(self):
+        if self.__bulk_load:
+            return
         self._con.commit()
 
+    @property
+    def schema_version(self) -> int:
+        return self.one("PRAGMA schema_version")
+
+    @property
+    def is_changed(self) -> bool:
+        if self.__changes > 0:
+            return True
+        if self._con.total_changes != self.__total_changes:
+            return True
+        return self.schema_version != self.__schema_version
+
     def close(self, vacuum=True):
         if self.__readonly:
             self._con.close()
@@ -296,17 +1008,44 @@ class DBLite:
         self.closeTransaction()
         self._con.commit()
         if vacuum:
-            ic = self.get_integrity_check() or "¿?"
-            logger.info(f"integrity_check = {ic}")
+            self.maintain()
+        self._con.commit()
+        self._con.close()
+
+    def maintain(self, maintenance: Union[None, Maintenance] = None):
+        m = maintenance or self.__maintenance
+        if m.only_if_changed and not self.is_changed:
+            logger.debug("maintenance skipped: no changes")
+            return
+        if m.integrity_check != "none":
+            quick = m.integrity_check == "quick"
+            ic = self.get_integrity_check(quick=quick) or "¿?"
+            logger.info(("quick_check" if quick else "integrity_check") + f" = {ic}")
+        if m.foreign_key_check:
             fkc = self.get_foreign_key_check()
             logger.info("foreign_key_check = " + ("ko" if fkc else "ok"))
             for table, parent in fkc:
                 logger.info(f"  {table} -> {parent}")
-            self._con.execute("VACUUM")
+        if m.analyze:
+            self._con.execute("ANALYZE")
+        if m.optimize:
+            self._con.execute("PRAGMA optimize")
         self._con.commit()
-        self._con.close()
+        if m.vacuum != "none" and self.get_freelist_ratio() >= m.min_freelist_ratio:
+            if m.vacuum == "incremental":
+                self.to_tuple("PRAGMA incremental_vacuum")
+            else:
+                self._con.execute("VACUUM")
+
+    def get_freelist_ratio(self) -> float:
+        page_count = self.one("PRAGMA page_count")
+        if not page_count:
+            return 0
+        return self.one("PRAGMA freelist_count") / page_count
 
-    def get_integrity_check(self):
+    def get_integrity_check(self, quick=False):
+        if quick:
+            return self.one("pragma quick_check")
         return self.one("pragma integrity_check")
 
     def get_foreign_key_check(self):
@@ -317,17 +1056,65 @@ class DBLite:
                 data.append(tp)
         return tuple(data)
 
-    def select(self, sql: str, *args, row_factory=None, **kwargs):
-        self._con.row_factory = row_factory
+    def _cursor(self, sql: str, *args, row_factory=None):
         cursor = self._con.cursor()
         if len(args):
             cursor.execute(sql, args)
         else:
             cursor.execute(sql)
-        for r in ResultIter(cursor):
-            yield r
-        cursor.close()
-        self._con.row_factory = None
+        cursor.row_factory = CursorFactory.get(cursor, row_factory)
+        return cursor
+
+    def select(self, sql: str, *args, row_factory=None, **kwargs):
+        token = self.__tracer.start() if self.__tracer else None
+        rows = 0
+        cursor = self._cursor(sql, *args, row_factory=row_factory)
+        try:
+            for r in ResultIter(cursor):
+                rows = rows + 1
+                yield r
+        finally:
+            cursor.close()
+            if token:
+                self.__tracer.end(token, sql, args, rows=rows)
+
+    def get_decltypes(self, sql: str) -> Tuple[Union[None, str], ...]:
+        view = "temp.__dblite_decltypes"
+        try:
+            self._con.execute(f"CREATE TEMP VIEW {view} AS {sql}")
+        except (sqlite3.OperationalError, sqlite3.Warning):
+            return tuple()
+        try:
+            return tuple(r[0] for r in self._con.execute("SELECT type FROM pragma_table_info('__dblite_decltypes', 'temp')"))
+        finally:
+            self._con.execute(f"DROP VIEW {view}")
+
+    def select_columnar(self, sql: str, *args, chunk_rows: int = 65536):
+        import numpy as np
+
+        affinities = tuple(map(get_affinity, self.get_decltypes(sql))) if len(args) == 0 else tuple()
+        token = self.__tracer.start() if self.__tracer else None
+        count = 0
+        cursor = self._cursor(sql, *args)
+        try:
+            cols = tuple(col[0] for col in (cursor.description or tuple()))
+            if len(affinities) != len(cols):
+                affinities = (None, ) * len(cols)
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                count = count + len(rows)
+                data = np.empty((len(rows), len(cols)), dtype=object)
+                data[:] = rows
+                yield {
+                    c: _to_masked_array(data[:, i], a)
+                    for i, (c, a) in enumerate(zip(cols, affinities))
+                }
+        finally:
+            cursor.close()
+            if token:
+                self.__tracer.end(token, sql, args, rows=count)
 
     def to_tuple(self, *args, **kwargs):
         arr = []
@@ -349,100 +1136,325 @@ class DBLite:
         return dct
 
     def one(self, sql: str, *args, row_factory=None):
-        self._con.row_factory = row_factory
-        cursor = self._con.cursor()
-        if len(args):
-            cursor.execute(sql, args)
-        else:
-            cursor.execute(sql)
-        r = cursor.fetchone()
-        cursor.close()
-        self._con.row_factory = None
+        token = self.__tracer.start() if self.__tracer else None
+        cursor = self._cursor(sql, *args, row_factory=row_factory)
+        try:
+            r = cursor.fetchone()
+        finally:
+            cursor.close()
+        if token:
+            self.__tracer.end(token, sql, args, rows=int(r is not None))
         if not r:
             return None
         if isinstance(r, tuple) and len(r) == 1:
             return r[0]
         return r
 
-    def iter_sql_backup(self, width_values=-1, multiple_limit=-1):
-        re_insert = re.compile(r'^INSERT\s+INTO\s+(.+)\s+VALUES\s*\((.*)\);$')
-        yield 'PRAGMA foreign_keys=OFF;'
-        yield 'BEGIN TRANSACTION;'
-        for lines in self._con.iterdump():
-            for line in lines.split("\n"):
+    def __get_dump_schema(self):
+        tables: List[Tuple[str, Tuple[str, ...]]] = []
+        others: List[str] = []
+        has_sequence = False
+        schema: List[Tuple[str, str]] = []
+        for name, tp, sql in self._con.execute('''
+            SELECT "name", "type", "sql" FROM "sqlite_master" WHERE "sql" NOT NULL
+        '''):
+            if tp == 'table':
+                schema.append((name, sql))
+            elif tp in ('index', 'trigger', 'view'):
+                others.append(sql + ";")
+        for name, sql in sorted(schema):
+            if name == 'sqlite_sequence':
+                has_sequence = True
+                continue
+            if name == 'sqlite_stat1':
+                tables.append((name, ('ANALYZE "sqlite_master";', )))
+            elif name.startswith('sqlite_'):
+                continue
+            elif sql.startswith('CREATE VIRTUAL TABLE'):
+                tables.append((name, ("INSERT INTO sqlite_master(type,name,tbl_name,rootpage,sql)VALUES('table','{0}','{0}',0,'{1}');".format(
+                    name.replace("'", "''"),
+                    sql.replace("'", "''")
+                ), )))
+            else:
+                tables.append((name, (sql + ";", )))
+        return tuple(tables), tuple(others), has_sequence
+
+    @staticmethod
+    def __iter_dump_lines(sqls: Iterable[str]):
+        for sql in sqls:
+            for line in sql.split("\n"):
                 ln = line.strip().upper()
-                if ln in ("", "COMMIT;", "BEGIN TRANSACTION;"):
-                    continue
-                if ln.startswith("INSERT INTO ") or ln.startswith("--"):
+                if ln in ("", "COMMIT;", "BEGIN TRANSACTION;") or ln.startswith("--"):
                     continue
                 yield line
-        table = None
-        lsttb = None
-        count = 0
-        values: List[str] = []
-
-        def val_to_str(vls: List[str], end: str):
-            return ",".join(vls)+end
 
-        for line in self._con.iterdump():
-            m = re_insert.match(line)
-            if m is None:
-                continue
+    @staticmethod
+    def __is_virtual(sqls: Tuple[str, ...]):
+        # los datos de una tabla virtual ya van en sus tablas sombra
+        return sqls[0].startswith("INSERT INTO sqlite_master(")
+
+    def __iter_dump_schema(self, tables: Tuple[Tuple[str, Tuple[str, ...]], ...]):
+        writable_schema = False
+        for _, sqls in tables:
+            if not writable_schema and DBLite.__is_virtual(sqls):
+                writable_schema = True
+                yield 'PRAGMA writable_schema=ON;'
+            yield from sqls
+        if writable_schema:
+            yield 'PRAGMA writable_schema=OFF;'
+
+    def __iter_dump_rows(self, table: str):
+        t = self.__get_catalog().get_table(table)
+        cols = t.cols if t is not None else self.get_cols(table)
+        vals = "||','||".join('quote("' + c.replace('"', '""') + '")' for c in cols)
+        table = table.replace('"', '""')
+        cursor = self._con.cursor()
+        try:
+            cursor.execute(f'''SELECT '('||{vals}||')' FROM "{table}"''')
+            for r in ResultIter(cursor):
+                yield r[0]
+        finally:
+            cursor.close()
+
+    def __iter_dump_values(self, table: str, width_values=-1, multiple_limit=-1, max_size=-1):
+        header = 'INSERT INTO "' + table.replace('"', '""') + '" VALUES'
+        values: List[str] = []
+        width = 0
+        count = 0
+        size = 0
+        for row in self.__iter_dump_rows(table):
             if multiple_limit == 1:
-                yield line
+                yield header + row + ";"
                 continue
-            table = m.group(1)
-            if table != lsttb or count == 0:
+            if count == 0:
                 if values:
-                    yield val_to_str(values, ";")
+                    yield ",".join(values) + ";"
                     values = []
-                yield f'INSERT INTO {table} VALUES'
+                yield header
                 count = multiple_limit
-            values.append("("+m.group(2)+")")
-            if len(values) > 1 and len(",".join(values)) > width_values:
-                yield val_to_str(values[:-1], ",")
-                values = [values[-1]]
+                width = -1
+                size = len(header)
+            width = width + 1 + len(row)
+            size = size + 1 + len(row)
+            values.append(row)
+            if len(values) > 1 and width > width_values:
+                yield ",".join(values[:-1]) + ","
+                values = [row]
+                width = len(row)
             count = count - 1
-            lsttb = table
+            if 0 < max_size <= size:
+                # cierra el INSERT para que write_sql pueda cortar la parte
+                count = 0
         if values:
-            yield val_to_str(values, ";")
-            values = []
+            yield ",".join(values) + ";"
+
+    def __iter_dump_table(self, table: Tuple[str, Tuple[str, ...]], width_values=-1, multiple_limit=-1, max_size=-1):
+        yield 'PRAGMA foreign_keys=OFF;'
+        yield 'BEGIN TRANSACTION;'
+        yield from DBLite.__iter_dump_lines(self.__iter_dump_schema((table, )))
+        if not DBLite.__is_virtual(table[1]):
+            yield from self.__iter_dump_values(table[0], width_values=width_values, multiple_limit=multiple_limit, max_size=max_size)
+        yield 'COMMIT;'
 
+    def iter_sql_backup(self, width_values=-1, multiple_limit=-1, tables=True, others=True, max_size=-1):
+        yield 'PRAGMA foreign_keys=OFF;'
+        yield 'BEGIN TRANSACTION;'
+        schema, extra, has_sequence = self.__get_dump_schema()
+        if not tables:
+            schema = tuple()
+        if not others:
+            extra = tuple()
+            has_sequence = False
+        yield from DBLite.__iter_dump_lines(self.__iter_dump_schema(schema))
+        for table, sqls in schema:
+            if DBLite.__is_virtual(sqls):
+                continue
+            yield from self.__iter_dump_values(table, width_values=width_values, multiple_limit=multiple_limit, max_size=max_size)
+        if has_sequence:
+            yield 'DELETE FROM "sqlite_sequence";'
+            yield from self.__iter_dump_values('sqlite_sequence', width_values=width_values, multiple_limit=multiple_limit)
+        # índices, vistas y triggers después de los datos: los triggers no se
+        # disparan al cargar y los índices se construyen de una vez
+        yield from DBLite.__iter_dump_lines(extra)
         yield 'COMMIT;'
         yield 'VACUUM;'
         yield 'PRAGMA foreign_keys=ON;'
         yield 'pragma integrity_check;'
         yield 'pragma foreign_key_check;'
 
-    def sql_backup(self, *args, **kwargs):
+    def sql_backup(self, *args, compress: Union[None, str] = None, part_size: int = -1, per_table: bool = False, workers: int = 1, **kwargs):
         nam_file = self.file.rsplit(".", 1)[0]
-        with open(nam_file+".sql", "w") as f:
-            for line in self.iter_sql_backup(*args, **kwargs):
-                f.write(line+"\n")
+        if not per_table:
+            return write_sql(nam_file, self.iter_sql_backup(*args, max_size=part_size, **kwargs), compress=compress, part_size=part_size)
+
+        def __dump(db: DBLite, item: Tuple[int, Tuple[str, Tuple[str, ...]]]):
+            i, table = item
+            lines = db.__iter_dump_table(table, *args, max_size=part_size, **kwargs)
+            return write_sql(f"{nam_file}.part{i:03d}", lines, compress=compress, part_size=part_size)
+
+        self.commit()
+        tables, _, _ = self.__get_dump_schema()
+        items = tuple(enumerate(tables, start=1))
+        if workers > 1 and self.file not in (None, "", MEMORY):
+            with DBLitePool(self.file, size=workers, extensions=self.__extensions) as pool:
+                files = tuple(pool.map(__dump, items))
+        else:
+            files = tuple(__dump(self, item) for item in items)
+        lines = self.iter_sql_backup(*args, tables=False, max_size=part_size, **kwargs)
+        files = files + (write_sql(f"{nam_file}.part{len(items) + 1:03d}", lines, compress=compress, part_size=part_size), )
+        return tuple(f for fls in files for f in fls)
 
-    def backup(self, target: Union[sqlite3.Connection, "DBLite", str]):
+    @staticmethod
+    def __backup(
+            source: sqlite3.Connection,
+            target: Union[sqlite3.Connection, "DBLite", str],
+            pages: int,
+            sleep: float,
+            progress: Union[None, Callable[[BackupProgress], Any]],
+            vacuum: bool,
+            tracer: Union[None, SqlTracer] = None
+    ):
         if isinstance(target, DBLite):
             target = target._con
-        if isinstance(target, sqlite3.Connection):
-            self._con.backup(target)
+        if vacuum:
+            if not isinstance(target, str) or target == MEMORY:
+                raise ValueError(target)
+            if progress is None:
+                source.execute("VACUUM INTO ?", (target, ))
+                return
+            start = perf_counter()
+            total = source.execute("PRAGMA page_count").fetchone()[0]
+            cancelled: List[BackupCancelled] = []
+
+            def __on_vacuum():
+                try:
+                    progress(BackupProgress(total=total, remaining=total, elapsed=perf_counter() - start))
+                except BackupCancelled as e:
+                    cancelled.append(e)
+                    return 1
+                return 0
+            source.set_progress_handler(__on_vacuum, 100000)
+            try:
+                source.execute("VACUUM INTO ?", (target, ))
+            except sqlite3.OperationalError:
+                if not cancelled:
+                    raise
+                if isfile(target):
+                    os.remove(target)
+                raise cancelled[0]
+            finally:
+                if tracer is not None:
+                    tracer.restore_progress()
+                else:
+                    source.set_progress_handler(None, 0)
+            progress(BackupProgress(total=total, remaining=0, elapsed=perf_counter() - start))
             return
-        if isinstance(target, str) and target != MEMORY:
-            with DBLite(target) as con:
-                self._con.backup(con._con)
+        if isinstance(target, str):
+            if target == MEMORY:
+                raise ValueError(target)
+            is_new = not isfile(target)
+            con = sqlite3.connect(target)
+            try:
+                DBLite.__backup(source, con, pages, sleep, progress, vacuum)
+            except BackupCancelled:
+                con.close()
+                if is_new and isfile(target):
+                    os.remove(target)
+                raise
+            con.close()
             return
-        raise ValueError(target)
+        if not isinstance(target, sqlite3.Connection):
+            raise ValueError(target)
+        callback = None
+        if progress is not None:
+            start = perf_counter()
 
-    def register_function(self, name: str, num_params: int, func: Callable, is_aggregate=False):
-        def __func(*args, **kwargs):
+            def callback(status: int, remaining: int, total: int):
+                progress(BackupProgress(total=total, remaining=remaining, elapsed=perf_counter() - start))
+        source.backup(target, pages=pages, progress=callback, sleep=sleep)
+
+    def backup(
+            self,
+            target: Union[sqlite3.Connection, "DBLite", str],
+            pages: int = -1,
+            sleep: float = 0.250,
+            progress: Union[None, Callable[[BackupProgress], Any]] = None,
+            vacuum: bool = False
+    ):
+        DBLite.__backup(self._con, target, pages, sleep, progress, vacuum, self.__tracer)
+
+    def start_backup(
+            self,
+            target: str,
+            pages: int = 1024,
+            sleep: float = 0.250,
+            vacuum: bool = False
+    ) -> BackupHandle:
+        if not isinstance(target, str) or target == MEMORY:
+            raise ValueError(target)
+        file = self.file
+
+        def __run(handle: BackupHandle):
+            if not file:
+                DBLite.__backup(self._con, target, pages, sleep, handle._on_progress, vacuum, self.__tracer)
+                return target
+            with DBLite(file, readonly=True) as db:
+                DBLite.__backup(db._con, target, pages, sleep, handle._on_progress, vacuum)
+            return target
+
+        if not file and self.__check_same_thread:
+            raise DBLiteException(f"start_backup of {MEMORY} needs check_same_thread=False")
+        return BackupHandle(__run)
+
+    def register_function(self, name: str, num_params: int, func: Callable, is_aggregate=False, deterministic=False, memoize: int = 0):
+        stat = FunctionStat(name=name)
+        call = func
+        if memoize != 0 and not is_aggregate:
+            call = lru_cache(maxsize=(None if memoize < 0 else memoize), typed=True)(func)
+            stat.cache = call
+
+        def __func(*args):
             try:
-                return func(*args, **kwargs)
+                return call(*args)
             except:
                 logger.error(func.__name__, exc_info=True)
                 raise
+
+        def __timed_func(*args):
+            start = perf_counter()
+            try:
+                return __func(*args)
+            finally:
+                stat.calls = stat.calls + 1
+                stat.time = stat.time + (perf_counter() - start)
+
+        # medir cada llamada cuesta, solo se hace si se piden estadísticas
+        fnc = __timed_func if self.__stats else __func
+        self.__function_stats[name] = stat
         if is_aggregate:
-            self._con.create_aggregate(name, num_params, mkAgregator(__func))
+            self._con.create_aggregate(name, num_params, mkAgregator(fnc))
         else:
-            self._con.create_function(name, num_params, __func)
+            self._con.create_function(name, num_params, fnc, deterministic=deterministic)
+
+    def register_reducer(self, name: str, reducer: Reducer, num_params: int = 1):
+        stat = FunctionStat(name=name)
+        self.__function_stats[name] = stat
+        self._con.create_aggregate(name, num_params, mkReducer(reducer, stat, timed=self.__stats))
+
+    def register_reducers(self, reducers: Dict[str, Reducer] = None):
+        for name, reducer in (reducers or REDUCERS).items():
+            self.register_reducer(name, reducer)
+
+    def reduce(self, reducer: Reducer, sql: str, *args):
+        state = reducer.init()
+        for r in self.select(sql, *args, row_factory=tuple_factory):
+            if r[0] is not None:
+                state = reducer.step(state, *r)
+        return state
+
+    @property
+    def function_stats(self) -> Tuple["FunctionStat", ...]:
+        return tuple(self.__function_stats.values())
 
 
 class LazzyDBLite:
@@ -461,3 +1473,93 @@ class LazzyDBLite:
         if self.__db is not None:
             self.__db.close()
             self.__db = None
+
+
+class DBLitePool:
+    def __init__(
+            self,
+            file: str,
+            size: int = 4,
+            readonly: bool = True,
+            wal: bool = False,
+            mmap_size: int = 256 * 1024 * 1024,
+            factory: Callable[..., DBLite] = DBLite,
+            **kwargs
+    ):
+        if wal and file != MEMORY:
+            with closing(sqlite3.connect(file)) as con:
+                con.execute("PRAGMA journal_mode=WAL")
+        self.__file = file
+        self.__factory = factory
+        self.__size = size
+        self.__mmap_size = mmap_size
+        self.__kwargs = dict(kwargs, readonly=readonly, check_same_thread=False)
+        self.__functions: List[Tuple[Tuple, Dict[str, Any]]] = []
+        self.__dbs: List[DBLite] = []
+        self.__applied: Dict[int, int] = {}
+        self.__local = local()
+        self.__lock = Lock()
+        self.__executor: Union[None, ThreadPoolExecutor] = None
+
+    def __enter__(self, *args, **kwargs):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    @property
+    def db(self) -> DBLite:
+        db: Union[None, DBLite] = getattr(self.__local, "db", None)
+        if db is None:
+            db = self.__factory(self.__file, **self.__kwargs)
+            if self.__mmap_size > 0:
+                db._con.execute(f"PRAGMA mmap_size={self.__mmap_size}")
+            with self.__lock:
+                self.__dbs.append(db)
+            self.__local.db = db
+        applied = self.__applied.get(id(db), 0)
+        for args, kwargs in self.__functions[applied:]:
+            db.register_function(*args, **kwargs)
+        self.__applied[id(db)] = len(self.__functions)
+        return db
+
+    def register_function(self, name: str, num_params: int, func: Callable, **kwargs):
+        with self.__lock:
+            self.__functions.append(((name, num_params, func), kwargs))
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__size, thread_name_prefix="DBLitePool")
+        return self.__executor
+
+    def map(self, fnc: Callable[[DBLite, Any], Any], items: Iterable):
+        def __run(item):
+            return fnc(self.db, item)
+        return self.executor.map(__run, items)
+
+    def map_queries(self, sqls: Iterable[Union[str, Tuple]], row_factory=None):
+        def __run(db: DBLite, sql: Union[str, Tuple]):
+            args = tuple()
+            if isinstance(sql, tuple):
+                sql, args = sql[0], sql[1:]
+            return tuple(db.select(sql, *args, row_factory=row_factory))
+        return tuple(self.map(__run, sqls))
+
+    def map_reduce(self, reducer: Reducer, sqls: Iterable[Union[str, Tuple]]):
+        def __run(db: DBLite, sql: Union[str, Tuple]):
+            args = tuple()
+            if isinstance(sql, tuple):
+                sql, args = sql[0], sql[1:]
+            return db.reduce(reducer, sql, *args)
+        return reduce_states(reducer, self.map(__run, sqls))
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+        with self.__lock:
+            for db in self.__dbs:
+                db.close(vacuum=False)
+            self.__dbs = []
+            self.__applied = {}
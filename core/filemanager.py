@@ -6,13 +6,11 @@ from pathlib import Path
 from tempfile import gettempdir
 import pickle
 import csv as csvwriter
-from openpyxl import load_workbook
-from openpyxl.worksheet.worksheet import Worksheet
-from openpyxl.utils import get_column_letter
 from configparser import ConfigParser, MissingSectionHeaderError
-from openpyxl.worksheet.worksheet import Worksheet
+from typing import TYPE_CHECKING
 
-import pandas as pd
+if TYPE_CHECKING:
+    import pandas as pd
 
 logger = logging.getLogger(__name__)
 
@@ -207,6 +205,7 @@ class FileManager:
             json.dump(obj, f, *args, indent=indent, **kvargs)
 
     def load_csv(self, file: Path, *args, **kvargs):
+        import pandas as pd
         return pd.read_csv(file, *args, **kvargs)
 
     def dump_properties(self, file: Path, config: ConfigParser, *args, **kvargs):
@@ -229,7 +228,7 @@ class FileManager:
             return
         obj.to_csv(file, *args, **kvargs)
 
-    def dump_xls(self, file: Path, obj: pd.DataFrame, *args, prettify=False, **kvargs):
+    def dump_xls(self, file: Path, obj: "pd.DataFrame", *args, prettify=False, **kvargs):
         max_rows = 200000 - 1
         if len(obj) > max_rows:
             count = 0
@@ -244,6 +243,9 @@ class FileManager:
         if not prettify:
             return
 
+        from openpyxl import load_workbook
+        from openpyxl.utils import get_column_letter
+
         WB = load_workbook(file)
         for ws in WB.worksheets:
             if not(ws.max_row > 1 or ws.max_column > 1 or ws['A1'].value is not None):
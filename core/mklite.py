@@ -1,23 +1,37 @@
-from os.path import basename, join
-from os import walk
+from os.path import basename, join, isfile, getsize
+from os import walk, cpu_count, remove, close as close_fd
 import sqlite3
-import pandas as pd
-from unidecode import unidecode
 import re
 
 import logging
-from core.dblite import DBLite
-from core.dblite import MEMORY
+from core.dblite import DBLite, DBLitePool, sql_can_be_int, get_affinity
+from core.dblite import MEMORY, COMPRESS, find_sql_parts, open_sql, iter_sql_statements
 from core.shell import Shell
+from core.catalog import Table
 import zipfile
 import tempfile
+import csv
 
-from typing import Union, Dict
+from dataclasses import dataclass, replace
+from typing import Any, Union, Dict, Tuple, List
 
 logger = logging.getLogger(__name__)
 
+# presupuesto de memoria de MEMLite: fuentes mayores se cargan directamente a disco
+MEMORY_MB = 1024
+# tamaño estimado de un fichero comprimido una vez descomprimido
+COMPRESS_RATIO = 5
+# los csv se leen por bloques de CSV_CHUNK_ROWS filas
+CSV_CHUNK_ROWS = 50000
+# valores que pandas lee como booleanos
+CSV_TRUE = ("True", "TRUE", "true")
+CSV_FALSE = ("False", "FALSE", "false")
+CSV_HEADER_ROWS = 100
+CSV_SAMPLE_BYTES = 64 * 1024
+
 
 def normalize_name(s: str, prefix: str):
+    from unidecode import unidecode
     s = unidecode(s)
     s = s.strip()
     s = re.sub(r"[\s_\-\.\(\)\/;,]+", "_", s)
@@ -28,18 +42,233 @@ def normalize_name(s: str, prefix: str):
     return s
 
 
-def can_be_int(s):
-    if s is None:
-        return True
-    if isinstance(s, float):
-        return int(s) == s
-    if isinstance(s, int):
-        return True
-    if not isinstance(s, str):
-        return False
-    if s.isdigit():
+@dataclass(frozen=True)
+class ColumnProfile:
+    name: str
+    type: str
+    rows: int
+    not_null: int
+    not_int: int
+    min_length: Union[None, int]
+    max_length: Union[None, int]
+    dirty: int
+    reals: int = 0
+    texts: int = 0
+    blobs: int = 0
+    wide: int = 0
+    avg_length: Union[None, float] = None
+
+    @staticmethod
+    def get_value_sql(name: str, type: str):
+        if type == "TEXT":
+            return f'''NULLIF(TRIM("{name}"), '')'''
+        return f'"{name}"'
+
+    @property
+    def value_sql(self):
+        return ColumnProfile.get_value_sql(self.name, self.type)
+
+    @property
+    def has_nulls(self):
+        return self.not_null < self.rows
+
+    @property
+    def new_type(self):
+        if self.not_null == 0:
+            return self.type
+        if self.type in ('REAL', 'TEXT') and self.not_int == 0:
+            return 'INTEGER'
+        if self.type == 'TEXT':
+            if self.min_length == self.max_length:
+                return f"CHAR({self.max_length})"
+            return f"VARCHAR({self.max_length})"
+        return self.type
+
+    @property
+    def strict_type(self):
+        affinity = get_affinity(self.new_type)
+        if self.not_null == 0:
+            return affinity if affinity in ("INTEGER", "REAL", "TEXT") else "ANY"
+        if self.blobs > 0:
+            return "BLOB" if self.blobs == self.not_null else "ANY"
+        if affinity == "INTEGER" and self.type in ('REAL', 'TEXT'):
+            # wide: reales o textos que no caben en un entero de 64 bits
+            if self.wide == 0:
+                return "INTEGER"
+            return "REAL" if self.type == "REAL" and self.texts == 0 else "ANY"
+        if affinity == "TEXT":
+            return "TEXT"
+        if self.texts == 0 and self.reals == 0:
+            return "INTEGER"
+        if self.texts == 0 and affinity == "REAL":
+            return "REAL"
+        if self.reals == 0 and self.texts == self.not_null:
+            return "TEXT"
+        return "ANY"
+
+    @property
+    def strict_value_sql(self):
+        if self.strict_type == "INTEGER" and self.type in ('REAL', 'TEXT') and self.not_null > 0:
+            return f"CAST({self.value_sql} AS INTEGER)"
+        return self.value_sql
+
+    @property
+    def width(self):
+        if self.not_null == 0:
+            return 1
+        if self.strict_type == "INTEGER":
+            return 5
+        if self.strict_type == "REAL":
+            return 9
+        return 2 + round(self.avg_length or 8)
+
+
+PAGE_SIZES = (4096, 8192, 16384, 32768, 65536)
+
+
+def get_page_size(row_width: int):
+    # una fila de una tabla WITHOUT ROWID no debería ocupar más de 1/20 de la página
+    for size in PAGE_SIZES:
+        if row_width * 20 <= size:
+            return size
+    return PAGE_SIZES[-1]
+
+
+def quote_name(name: str):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def get_table_options(sql: Union[None, str]):
+    m = re.search(r"\)\s*((?:WITHOUT\s+ROWID|STRICT)(?:\s*,\s*(?:WITHOUT\s+ROWID|STRICT))?)\s*;?\s*$", sql or "", re.IGNORECASE)
+    return " " + m.group(1) if m else ""
+
+
+def is_related_name(col: str, table: str, table_col: str):
+    def __stem(s: str):
+        s = s.lower()
+        if len(s) > 4 and s.endswith("es"):
+            return s[:-2]
+        if len(s) > 3 and s.endswith("s"):
+            return s[:-1]
+        return s
+
+    col = col.lower()
+    if col == table_col.lower() or __stem(table) in col:
         return True
-    return False
+    return len(table_col) > 3 and table_col.lower() in col
+
+
+@dataclass(frozen=True)
+class Constraint:
+    table: str
+    kind: str
+    cols: Tuple[str, ...]
+    ref_table: Union[None, str] = None
+    ref_cols: Tuple[str, ...] = tuple()
+    created: bool = True
+
+    def __str__(self):
+        cols = ", ".join(self.cols)
+        s = f"{self.table}: {self.kind} ({cols})"
+        if self.ref_table is not None:
+            s = s + f" REFERENCES {self.ref_table} ({', '.join(self.ref_cols)})"
+        if not self.created:
+            s = s + " (no creada, la tabla no se puede reconstruir)"
+        return s
+
+
+@dataclass(frozen=True)
+class Encoding:
+    table: str
+    column: str
+    lookup: str
+    values: int
+    rows: int
+
+    def __str__(self):
+        return f"{self.table}.{self.column}: {self.values} valores en {self.lookup} ({self.rows} filas)"
+
+
+@dataclass(frozen=True)
+class KeyProfile:
+    table: str
+    rows: int
+    not_null: Dict[str, int]
+    distinct: Dict[str, int]
+    min: Dict[str, Any]
+    max: Dict[str, Any]
+    integers: Dict[str, int]
+    pairs: Dict[Tuple[str, str], int]
+
+    @property
+    def keys(self) -> Tuple[Tuple[str, ...], ...]:
+        if self.rows == 0:
+            return tuple()
+        singles = tuple(
+            (c, ) for c, d in self.distinct.items()
+            if d == self.rows and self.not_null[c] == self.rows
+        )
+        if singles:
+            return singles
+        return tuple(
+            p for p, d in self.pairs.items()
+            if d == self.rows and all(self.not_null[c] == self.rows for c in p)
+        )
+
+
+@dataclass(frozen=True)
+class TableProfile:
+    table: str
+    columns: Tuple[ColumnProfile, ...]
+    keys: Union[None, KeyProfile] = None
+
+
+@dataclass(frozen=True)
+class Compaction:
+    table: str
+    layout: str
+    key: Tuple[str, ...]
+    rows: int
+    size_before: Union[None, int] = None
+    size_after: Union[None, int] = None
+    compacted: bool = True
+
+    def __str__(self):
+        if not self.compacted:
+            return f"{self.table}: sin compactar, la usa una vista o un trigger"
+        s = f"{self.table}: {self.layout}"
+        if self.key:
+            s = s + f" PRIMARY KEY ({', '.join(self.key)})"
+        s = s + f", {self.rows} filas"
+        if self.size_before is not None and self.size_after is not None:
+            s = s + f", {self.size_before / 1024:.0f} KB → {self.size_after / 1024:.0f} KB"
+        return s
+
+
+def sniff_csv(file: str, delimiter: bool = False) -> Dict[str, str]:
+    ext = file.rsplit(".", 1)[-1].lower()
+    with COMPRESS.get(ext, open)(file, "rb") as f:
+        sample = f.read(CSV_SAMPLE_BYTES)
+    if len(sample) == CSV_SAMPLE_BYTES and b"\n" in sample:
+        # que no se corte un carácter multibyte
+        sample = sample[:sample.rindex(b"\n") + 1]
+    options: Dict[str, str] = {}
+    for encoding in ("utf-8", "cp1252", "latin-1"):
+        try:
+            text = sample.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    if text.startswith("\ufeff"):
+        encoding = "utf-8-sig"
+    if encoding != "utf-8":
+        options["encoding"] = encoding
+    if delimiter:
+        try:
+            options["sep"] = csv.Sniffer().sniff(text, delimiters=",;\t|").delimiter
+        except csv.Error:
+            pass
+    return options
 
 
 def iter_zip(file: str):
@@ -52,10 +281,6 @@ def iter_zip(file: str):
 
 
 class NormLite(DBLite):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.register_function("can_be_int", 1, can_be_int)
-
     def count(self, table: str, where: str = None):
         sql = f'select count(*) from "{table}"'
         if where:
@@ -65,34 +290,170 @@ class NormLite(DBLite):
     def notExists(self, table: str, where: str = None):
         return 0 == self.count(table, where)
 
-    def get_new_type(self, current_type, table, column):
-        if current_type == "TEXT":
-            self.run_modify_query(f'UPDATE "{table}" SET "{column}" = TRIM("{column}") where "{column}" is not null;')
-            self.run_modify_query(f'UPDATE "{table}" SET "{column}" = NULL where "{column}" = \'\';')
-        if 0 == self.count(table, where=f'"{column}" is not null'):
-            return current_type
-        if current_type in ('REAL', 'TEXT') and self.notExists(table, where=f'not can_be_int("{column}")'):
-            return 'INTEGER'
-        if current_type == 'TEXT':
-            min_length, max_length = self.one(f'select min(length("{column}")), max(length("{column}")) from "{table}" where "{column}" is not null')
-            if min_length == max_length:
-                return f"CHAR({max_length})"
-            return f"VARCHAR({max_length})"
-        return current_type
-
-    def normalize(self):
+    def get_profile(self, table: str, chunk_size: int = 300, strict: bool = False) -> Tuple[ColumnProfile, ...]:
+        columns = self.catalog.get_table(table).columns
+        if strict:
+            # el doble de columnas por campo, hay que mantenerse bajo SQLITE_MAX_COLUMN
+            chunk_size = chunk_size // 2
+        profiles: List[ColumnProfile] = []
+        for i in range(0, max(1, len(columns)), chunk_size):
+            chunk = columns[i:i + chunk_size]
+            vals = []
+            sql = ["count(*)"]
+            for j, c in enumerate(chunk):
+                # the subquery computes each cleaned value once per row
+                # (LIMIT -1 keeps SQLite from flattening it)
+                v = f"v{j}"
+                vals.append(f'{ColumnProfile.get_value_sql(c.name, c.type)} AS {v}, "{c.name}" AS o{j}')
+                sql.append(f"count({v})")
+                sql.append(f"sum(not {sql_can_be_int(v)})" if c.type in ('REAL', 'TEXT') else "0")
+                if c.type == "TEXT":
+                    sql.append(f'min(length({v})), max(length({v})), sum({v} is not o{j})')
+                else:
+                    sql.append("NULL, NULL, 0")
+                if strict:
+                    sql.append(
+                        f"sum(typeof({v}) = 'real'), sum(typeof({v}) = 'text'), sum(typeof({v}) = 'blob'), "
+                        f"sum(typeof({v}) = 'real' and abs({v}) >= 9e18 or typeof({v}) = 'text' and length({v}) > 18), "
+                        f"avg(length({v}))"
+                    )
+            r = self.select(f'select {", ".join(sql)} from (select {", ".join(vals)} from "{table}" limit -1)').__next__()
+            stride = 10 if strict else 5
+            for j, c in enumerate(chunk):
+                values = r[1 + j * stride:1 + (j + 1) * stride]
+                not_null, not_int, min_length, max_length, dirty = values[:5]
+                reals, texts, blobs, wide, avg_length = values[5:] if strict else (0, 0, 0, 0, None)
+                profiles.append(ColumnProfile(
+                    name=c.name,
+                    type=c.type,
+                    rows=r[0],
+                    not_null=not_null,
+                    not_int=not_int or 0,
+                    min_length=min_length,
+                    max_length=max_length,
+                    dirty=dirty or 0,
+                    reals=reals or 0,
+                    texts=texts or 0,
+                    blobs=blobs or 0,
+                    wide=wide or 0,
+                    avg_length=avg_length
+                ))
+        return tuple(profiles)
+
+    def get_table_profile(self, table: str, compact: bool = False) -> TableProfile:
+        columns = self.get_profile(table, strict=compact)
+        if not compact:
+            return TableProfile(table=table, columns=columns)
+        values = {c.name: c.strict_value_sql for c in columns}
+        return TableProfile(table=table, columns=columns, keys=self.get_key_profile(table, values=values))
+
+    def get_profiles(self, tables: Tuple[str, ...], workers: Union[None, int] = None, compact: bool = False) -> Dict[str, TableProfile]:
+        workers = min(len(tables), workers or cpu_count() or 1)
+        file = self.file
+        if workers < 2 or not file:
+            return {t: self.get_table_profile(t, compact=compact) for t in tables}
+        with DBLitePool(file, size=workers, factory=NormLite) as pool:
+            profiles = pool.map(lambda db, t: db.get_table_profile(t, compact=compact), tables)
+            return dict(zip(tables, profiles))
+
+    def get_table_sizes(self) -> Dict[str, int]:
+        try:
+            return dict(self.select('''
+                select m.tbl_name, sum(s.pgsize)
+                from dbstat s join sqlite_master m on m.name = s.name
+                group by m.tbl_name
+            '''))
+        except sqlite3.OperationalError:
+            return {}
+
+    def normalize(self, workers: Union[None, int] = None, compact: bool = False) -> Tuple[Compaction, ...]:
         is_changed = False
-        for original_table_name in self.tables:
-            if self.__normalize(original_table_name):
-                is_changed = True
+        tables = self.tables
+        self.commit()
+        profiles = self.get_profiles(tables, workers=workers, compact=compact)
+        compacted: List[Compaction] = []
+        if compact:
+            sizes = self.get_table_sizes()
+            referenced = {t for t in tables if self.__is_referenced(t)}
+            keys = {t: self.__get_compact_key(p) for t, p in profiles.items() if t not in referenced}
+            # solo las tablas WITHOUT ROWID guardan la fila entera en el árbol de la clave
+            widths = [
+                sum(c.width for c in p.columns) for t, p in profiles.items()
+                if keys.get(t) and not self.__is_rowid_key(p, keys[t])
+            ]
+            page_size = get_page_size(max((w for w in widths if w * 20 <= PAGE_SIZES[-1]), default=0))
+        with self.bulk_load():
+            for original_table_name in tables:
+                if compact and original_table_name in referenced:
+                    p = profiles[original_table_name]
+                    compacted.append(Compaction(table=p.table, layout="", key=tuple(), rows=p.keys.rows, compacted=False))
+                elif compact:
+                    compacted.append(self.__compact(profiles[original_table_name], keys[original_table_name], page_size))
+                    is_changed = True
+                elif self.__normalize(original_table_name, profiles[original_table_name].columns):
+                    is_changed = True
         if is_changed:
             self.commit()
+            if compact:
+                self.execute(f'PRAGMA page_size={page_size};')
             self.execute('VACUUM;')
             self.execute('PRAGMA foreign_keys=ON;')
             self.execute('pragma integrity_check;')
             self.execute('pragma foreign_key_check;')
+        if not compact:
+            return tuple()
+        new_sizes = self.get_table_sizes()
+        return tuple(
+            replace(c, size_before=sizes.get(original_table_name), size_after=new_sizes.get(c.table))
+            for original_table_name, c in zip(tables, compacted)
+        )
+
+    def __get_compact_key(self, p: TableProfile):
+        types = {c.name: c.strict_type for c in p.columns}
+        for k in p.keys.keys:
+            if all(types[c] in ("INTEGER", "TEXT") for c in k):
+                return k
+        return tuple()
+
+    @staticmethod
+    def __is_rowid_key(p: TableProfile, key: Tuple[str, ...]):
+        return len(key) == 1 and any(c.name == key[0] and c.strict_type == "INTEGER" for c in p.columns)
 
-    def __normalize(self, original_table_name: str):
+    def __compact(self, p: TableProfile, key: Tuple[str, ...], page_size: int):
+        new_table_name = normalize_name(p.table, prefix="t")
+        tmp_new_table_name = 'TMP_' + new_table_name
+        names = {c.name: normalize_name(c.name, prefix="c") for c in p.columns}
+        order = ("INTEGER", "REAL", "TEXT", "BLOB", "ANY")
+        # primero la clave y luego los tipos de ancho fijo, sin alterar el orden dentro de cada grupo
+        columns = sorted(
+            p.columns,
+            key=lambda c: (key.index(c.name) if c.name in key else len(key), order.index(c.strict_type))
+        )
+        defs = []
+        for c in columns:
+            d = f"{quote_name(names[c.name])} {c.strict_type}"
+            if not c.has_nulls:
+                d = d + " NOT NULL"
+            defs.append(d)
+        layout = "STRICT"
+        if key:
+            defs.append("PRIMARY KEY (" + ", ".join(quote_name(names[c]) for c in key) + ")")
+            if not self.__is_rowid_key(p, key) and sum(c.width for c in columns) * 20 <= page_size:
+                layout = "WITHOUT ROWID, STRICT"
+        self.execute(f'CREATE TABLE {quote_name(tmp_new_table_name)} ({", ".join(defs)}) {layout};')
+        new_cols = ", ".join(quote_name(names[c.name]) for c in columns)
+        old_cols = ", ".join(c.strict_value_sql for c in columns)
+        self.execute(f'INSERT INTO {quote_name(tmp_new_table_name)} ({new_cols}) SELECT {old_cols} FROM {quote_name(p.table)};')
+        self.execute(f'DROP TABLE {quote_name(p.table)};')
+        self.execute(f'ALTER TABLE {quote_name(tmp_new_table_name)} RENAME TO {quote_name(new_table_name)};')
+        return Compaction(
+            table=new_table_name,
+            layout=layout,
+            key=tuple(names[c] for c in key),
+            rows=p.keys.rows
+        )
+
+    def __normalize(self, original_table_name: str, profiles: Tuple[ColumnProfile, ...]):
         need_normalize = False
         new_table_name = normalize_name(original_table_name, prefix="t")
         tmp_new_table_name = 'TMP_' + new_table_name
@@ -100,22 +461,23 @@ class NormLite(DBLite):
         if new_table_name != original_table_name:
             need_normalize = True
 
-        columns_info = self.to_tuple(f'PRAGMA table_info("{original_table_name}")')
-
         columns_definitions = []
         columns_names = []
-        for column in columns_info:
-            old_column_name: str = column[1]
+        for column in profiles:
+            old_column_name: str = column.name
             new_column_name = normalize_name(old_column_name, prefix="c")
-            column_type = self.get_new_type(column[2], original_table_name, old_column_name)
-            if self.notExists(original_table_name, where=f'"{old_column_name}" is null'):
+            column_type = column.new_type
+            if not column.has_nulls:
                 column_type = f'{column_type} NOT NULL'
             columns_definitions.append(f"{new_column_name} {column_type}")
-            columns_names.append((old_column_name, new_column_name))
-            if new_column_name != old_column_name or column_type != column[2]:
+            columns_names.append((column.value_sql, new_column_name))
+            if new_column_name != old_column_name or column_type != column.type:
                 need_normalize = True
 
         if not need_normalize:
+            dirty = ", ".join(f'"{c.name}" = {c.value_sql}' for c in profiles if c.dirty > 0)
+            if dirty:
+                self.execute(f'UPDATE "{original_table_name}" SET {dirty};')
             return False
 
         new_columns_definitions_str = ", ".join(columns_definitions)
@@ -124,8 +486,9 @@ class NormLite(DBLite):
         # Execute the creation of the new table
         self.execute(create_new_table_sql)
 
-        # Copy data from the original table to the new table
-        old_columns_str = ", ".join(f'"{old_column_name}"' for old_column_name, _ in columns_names)
+        # Copy data from the original table to the new table, trimming texts and
+        # turning empty strings into NULL on the way
+        old_columns_str = ", ".join(value_sql for value_sql, _ in columns_names)
         new_columns_str = ", ".join(new_column_name for _, new_column_name in columns_names)
         copy_data_sql = f'INSERT INTO {tmp_new_table_name} ({new_columns_str}) SELECT {old_columns_str} FROM "{original_table_name}";'
         self.execute(copy_data_sql)
@@ -139,28 +502,443 @@ class NormLite(DBLite):
         return True
 
 
+    def get_key_profile(
+            self,
+            table: str,
+            max_pair_cols: int = 6,
+            chunk_size: int = 300,
+            values: Union[None, Dict[str, str]] = None
+    ) -> KeyProfile:
+        t = self.catalog.get_table(table)
+        if values is None:
+            values = {c.name: quote_name(c.name) for c in t.columns}
+            notnull = [c.name for c in t.columns if c.notnull][:max_pair_cols]
+        else:
+            # sin NOT NULL declarado, los pares con nulos se descartan tras el primer recorrido
+            notnull = list(t.cols[:max_pair_cols])
+        pairs = tuple((a, b) for i, a in enumerate(notnull) for b in notnull[i + 1:])
+        cols = t.cols
+        r_not_null: Dict[str, int] = {}
+        r_distinct: Dict[str, int] = {}
+        r_min: Dict[str, Any] = {}
+        r_max: Dict[str, Any] = {}
+        r_integers: Dict[str, int] = {}
+        r_pairs: Dict[Tuple[str, str], int] = {}
+        rows = 0
+        for i in range(0, max(1, len(cols)), chunk_size):
+            chunk = cols[i:i + chunk_size]
+            sql = ["count(*)"]
+            for j, c in enumerate(chunk):
+                q = f"k{j}"
+                sql.append(f"count({q}), count(distinct {q}), min({q}), max({q}), sum(typeof({q}) = 'integer')")
+            vals = ", ".join(f"{values[c]} AS k{j}" for j, c in enumerate(chunk))
+            r = self.select(f'select {", ".join(sql)} from (select {vals} from {quote_name(table)} limit -1)').__next__()
+            rows = r[0]
+            for j, c in enumerate(chunk):
+                r_not_null[c], r_distinct[c], r_min[c], r_max[c], r_integers[c] = r[1 + j * 5:6 + j * 5]
+                r_integers[c] = r_integers[c] or 0
+        # los pares solo hacen falta si ninguna columna es clave por sí sola,
+        # y no pueden serlo si el producto de sus valores distintos no llega al número de filas
+        if rows > 0 and not any(d == rows and r_not_null[c] == rows for c, d in r_distinct.items()):
+            pairs = tuple(
+                (a, b) for a, b in pairs
+                if r_not_null[a] == rows and r_not_null[b] == rows and r_distinct[a] * r_distinct[b] >= rows
+            )
+            if pairs:
+                notnull = [c for c in notnull if any(c in p for p in pairs)]
+                vals = {c: f"k{j}" for j, c in enumerate(notnull)}
+                sql = [f'''count(distinct quote({vals[a]}) || ',' || quote({vals[b]}))''' for a, b in pairs]
+                cols_sql = ", ".join(f"{values[c]} AS {v}" for c, v in vals.items())
+                r = self.select(f'select {", ".join(sql)} from (select {cols_sql} from {quote_name(table)} limit -1)').__next__()
+                r_pairs = dict(zip(pairs, r))
+        return KeyProfile(
+            table=table,
+            rows=rows,
+            not_null=r_not_null,
+            distinct=r_distinct,
+            min=r_min,
+            max=r_max,
+            integers=r_integers,
+            pairs=r_pairs
+        )
+
+    def __is_referenced(self, table: str):
+        # DROP + RENAME falla si una vista o un trigger usa la tabla
+        # (y los triggers de la propia tabla se perderían)
+        name = re.compile(r"(?<!\w)" + re.escape(table) + r"(?!\w)", re.IGNORECASE)
+        for sql, in self.select("select sql from sqlite_master where type in ('view', 'trigger')"):
+            if name.search(sql or ""):
+                return True
+        return False
+
+    def __is_rebuildable(self, table: str):
+        t = self.catalog.get_table(table)
+        if t.pk or t.foreign_keys or t.indexes:
+            return False
+        if self.__is_referenced(table):
+            return False
+        return not re.search(r"\b(CHECK|COLLATE|UNIQUE|GENERATED|PRIMARY|REFERENCES|AUTOINCREMENT)\b", t.sql or "", re.IGNORECASE)
+
+    def __get_primary_key(self, p: KeyProfile):
+        def __is_rowid_safe(key: Tuple[str, ...]):
+            if len(key) > 1:
+                return True
+            c = self.catalog.get_table(p.table).get_column(key[0])
+            return c.type.upper() != "INTEGER" or p.integers[key[0]] == p.rows
+
+        def __is_discrete(key: Tuple[str, ...]):
+            return all(get_affinity(self.catalog.get_table(p.table).get_column(c).type) != "REAL" for c in key)
+
+        for k in p.keys:
+            if __is_rowid_safe(k) and __is_discrete(k):
+                return k
+        return None
+
+    def __get_foreign_key(self, p: KeyProfile, col: str, pks: Dict[str, Tuple[str, ...]], profiles: Dict[str, KeyProfile]):
+        if p.not_null[col] == 0:
+            return None
+        affinity = get_affinity(self.catalog.get_table(p.table).get_column(col).type)
+        found: List[Tuple[str, str]] = []
+        for ref_table, pk in pks.items():
+            if len(pk) != 1 or (ref_table == p.table and pk[0] == col):
+                continue
+            ref = profiles[ref_table]
+            ref_col = pk[0]
+            if affinity != get_affinity(self.catalog.get_table(ref_table).get_column(ref_col).type):
+                continue
+            if p.distinct[col] > ref.rows:
+                continue
+            mn, mx, ref_mn, ref_mx = p.min[col], p.max[col], ref.min[ref_col], ref.max[ref_col]
+            if type(mn) == type(ref_mn) and type(mx) == type(ref_mx) and (mn < ref_mn or mx > ref_mx):
+                continue
+            if affinity != "TEXT" and not is_related_name(col, ref_table, ref_col):
+                continue
+            q = quote_name(col)
+            if self.one(f"select count(*) from {quote_name(p.table)} where {q} is not null and {q} not in (select {quote_name(ref_col)} from {quote_name(ref_table)})") == 0:
+                found.append((ref_table, ref_col))
+        if len(found) == 1:
+            return found[0]
+        for ref_table, ref_col in found:
+            if ref_table.lower() in col.lower():
+                return ref_table, ref_col
+        return None
+
+    def create_keys(self, max_pair_cols: int = 6) -> Tuple[Constraint, ...]:
+        tables = self.tables
+        profiles = {t: self.get_key_profile(t, max_pair_cols=max_pair_cols) for t in tables}
+        pks: Dict[str, Tuple[str, ...]] = {}
+        for t in tables:
+            pk = self.catalog.get_table(t).pk or self.__get_primary_key(profiles[t])
+            if pk:
+                pks[t] = pk
+        created: List[Constraint] = []
+        self.commit()
+        self.execute('PRAGMA foreign_keys=OFF;')
+        with self.bulk_load():
+            for t in tables:
+                table = self.catalog.get_table(t)
+                p = profiles[t]
+                fks: List[Constraint] = []
+                for c in table.cols:
+                    if (c, ) == pks.get(t) or any(c in fk.cols for fk in table.foreign_keys):
+                        continue
+                    ref = self.__get_foreign_key(p, c, pks, profiles)
+                    if ref:
+                        fks.append(Constraint(table=t, kind="FOREIGN KEY", cols=(c, ), ref_table=ref[0], ref_cols=(ref[1], )))
+                pk = None
+                if not table.pk and pks.get(t):
+                    pk = Constraint(table=t, kind="PRIMARY KEY", cols=pks[t])
+                if self.__is_rebuildable(t) and (pk or fks):
+                    self.__rebuild(table, pk, fks)
+                    if pk:
+                        created.append(pk)
+                    created.extend(fks)
+                else:
+                    # sin reconstruir la tabla las claves ajenas no se pueden añadir,
+                    # se informa de ellas y solo se crea su índice
+                    created.extend(replace(fk, created=False) for fk in fks)
+                    if pk:
+                        pk = Constraint(table=t, kind="UNIQUE", cols=pk.cols)
+                        if self.__create_index(pk):
+                            created.append(pk)
+                for key in p.keys:
+                    # solo textos: un número único en todas las filas (p.e. habitantes) suele ser casualidad
+                    if len(key) == 1 and key != pks.get(t) and get_affinity(table.get_column(key[0]).type) == "TEXT":
+                        uq = Constraint(table=t, kind="UNIQUE", cols=key)
+                        if self.__create_index(uq):
+                            created.append(uq)
+                for fk in fks:
+                    ix = Constraint(table=t, kind="INDEX", cols=fk.cols)
+                    if self.__create_index(ix):
+                        created.append(ix)
+        self.execute('ANALYZE;')
+        self.execute('PRAGMA foreign_keys=ON;')
+        return tuple(created)
+
+    def __has_index(self, c: Constraint):
+        table = self.catalog.get_table(c.table)
+        cols = tuple(col.lower() for col in c.cols)
+        if tuple(col.lower() for col in table.pk[:len(cols)]) == cols:
+            return c.kind != "UNIQUE" or len(table.pk) == len(cols)
+        for ix in table.indexes:
+            ix_cols = tuple((col or "").lower() for col in ix.cols)
+            if c.kind == "UNIQUE" and ix.unique and ix_cols == cols:
+                return True
+            if c.kind != "UNIQUE" and ix_cols[:len(cols)] == cols:
+                return True
+        return False
+
+    def __create_index(self, c: Constraint):
+        if self.__has_index(c):
+            return False
+        name = ("ux_" if c.kind == "UNIQUE" else "ix_") + "_".join((c.table, ) + c.cols)
+        unique = "UNIQUE " if c.kind == "UNIQUE" else ""
+        cols = ", ".join(quote_name(col) for col in c.cols)
+        self.execute(f'CREATE {unique}INDEX IF NOT EXISTS {quote_name(name)} ON {quote_name(c.table)} ({cols});')
+        return True
+
+    def __rebuild(self, table: Table, pk: Union[None, Constraint], fks: List[Constraint]):
+        tmp = "TMP_" + table.name
+        defs = []
+        for c in table.columns:
+            d = f'{quote_name(c.name)} {c.type}'.rstrip()
+            if c.notnull:
+                d = d + " NOT NULL"
+            if c.default is not None:
+                d = d + " DEFAULT " + c.default
+            defs.append(d)
+        if pk:
+            defs.append("PRIMARY KEY (" + ", ".join(quote_name(c) for c in pk.cols) + ")")
+        for fk in fks:
+            cols = ", ".join(quote_name(c) for c in fk.cols)
+            ref_cols = ", ".join(quote_name(c) for c in fk.ref_cols)
+            defs.append(f'FOREIGN KEY ({cols}) REFERENCES {quote_name(fk.ref_table)} ({ref_cols})')
+        cols = ", ".join(quote_name(c) for c in table.cols)
+        self.execute(f'CREATE TABLE {quote_name(tmp)} ({", ".join(defs)}){get_table_options(table.sql)};')
+        self.execute(f'INSERT INTO {quote_name(tmp)} ({cols}) SELECT {cols} FROM {quote_name(table.name)};')
+        self.execute(f'DROP TABLE {quote_name(table.name)};')
+        self.execute(f'ALTER TABLE {quote_name(tmp)} RENAME TO {quote_name(table.name)};')
+
+    def __get_encodable(self, table: Table, max_ratio: float, min_rows: int, min_length: float):
+        skip = set(table.pk)
+        for fk in table.foreign_keys:
+            skip.update(fk.cols)
+        for ix in table.indexes:
+            if ix.unique:
+                skip.update(ix.cols)
+        cols = tuple(
+            c.name for c in table.columns
+            if get_affinity(c.type) == "TEXT" and c.name not in skip
+        )
+        if not cols:
+            return tuple()
+        sql = ["count(*)"]
+        for c in cols:
+            q = quote_name(c)
+            sql.append(f"count({q}), count(distinct {q} COLLATE BINARY), avg(length({q}))")
+        r = self.select(f'select {", ".join(sql)} from {quote_name(table.name)}').__next__()
+        if r[0] < min_rows:
+            return tuple()
+        encodable = []
+        for j, c in enumerate(cols):
+            not_null, distinct, length = r[1 + j * 3:4 + j * 3]
+            if not_null == 0 or length is None or length < min_length:
+                continue
+            if distinct / not_null <= max_ratio and self.__get_collation(table.name, c) is not None:
+                encodable.append((c, distinct))
+        return tuple(encodable)
+
+    def __get_collation(self, table: str, col: str) -> Union[None, str]:
+        # no hay pragma para el COLLATE de una columna, pero la comparación
+        # del plan lo lleva en P4 (p.e. NOCASE-8)
+        for r in self.select(f"EXPLAIN SELECT {quote_name(col)} < '' FROM {quote_name(table)}"):
+            if r[1] in ("Lt", "Le", "Gt", "Ge", "Eq", "Ne") and isinstance(r[5], str):
+                return r[5].rsplit("-", 1)[0].upper()
+        return None
+
+    def __is_encodable(self, table: Table):
+        if self.one("select count(*) from sqlite_master where type='trigger' and tbl_name = ?", table.name):
+            return False
+        for t in self.catalog.tables.values():
+            if t.name != table.name and any(fk.table.lower() == table.name.lower() for fk in t.foreign_keys):
+                return False
+            if t.type == 'view' and table.name.lower() in (t.sql or "").lower():
+                return False
+        for ix in table.indexes:
+            if ix.origin == 'c' and (None in ix.cols or " where " in (self.one("select sql from sqlite_master where name = ?", ix.name) or "").lower()):
+                return False
+        return (table.name + "_data") not in self.catalog.tables
+
+    def encode(self, max_ratio: float = 0.05, min_rows: int = 100, min_length: float = 4) -> Tuple[Encoding, ...]:
+        encoded: List[Encoding] = []
+        self.commit()
+        self.execute('PRAGMA foreign_keys=OFF;')
+        with self.bulk_load():
+            for t in self.tables:
+                table = self.catalog.get_table(t)
+                if not self.__is_encodable(table):
+                    continue
+                cols = tuple(
+                    (c, d) for c, d in self.__get_encodable(table, max_ratio, min_rows, min_length)
+                    if (t + "_" + c) not in self.catalog.tables
+                )
+                if cols:
+                    encoded.extend(self.__encode(table, cols))
+        if encoded and "sqlite_stat1" in self.catalog.tables:
+            self.execute('ANALYZE;')
+        self.execute('PRAGMA foreign_keys=ON;')
+        return tuple(encoded)
+
+    def __encode(self, table: Table, cols: Tuple[Tuple[str, int], ...]):
+        data = table.name + "_data"
+        lookups = {c: table.name + "_" + c for c, _ in cols}
+        for c, _ in cols:
+            lk = quote_name(lookups[c])
+            tp = table.get_column(c).type
+            collation = self.__get_collation(table.name, c)
+            if collation == "BINARY":
+                self.execute(f'CREATE TABLE {lk} (id INTEGER PRIMARY KEY, value {tp} NOT NULL UNIQUE);')
+            else:
+                # la columna conserva su COLLATE para la vista, pero el diccionario
+                # guarda todos los valores distintos byte a byte ('Madrid' y 'MADRID')
+                self.execute(f'CREATE TABLE {lk} (id INTEGER PRIMARY KEY, value {tp} COLLATE {collation} NOT NULL, UNIQUE (value COLLATE BINARY));')
+            self.execute(f'INSERT INTO {lk} (value) SELECT DISTINCT {quote_name(c)} COLLATE BINARY FROM {quote_name(table.name)} WHERE {quote_name(c)} IS NOT NULL ORDER BY 1;')
+
+        defs = []
+        for c in table.columns:
+            if c.name in lookups:
+                d = f'{quote_name(c.name)} INTEGER'
+            else:
+                d = f'{quote_name(c.name)} {c.type}'.rstrip()
+                if c.default is not None:
+                    d = d + " DEFAULT " + c.default
+            if c.notnull:
+                d = d + " NOT NULL"
+            defs.append(d)
+        if table.pk:
+            defs.append("PRIMARY KEY (" + ", ".join(map(quote_name, table.pk)) + ")")
+        for ix in table.indexes:
+            if ix.origin == 'u':
+                defs.append("UNIQUE (" + ", ".join(map(quote_name, ix.cols)) + ")")
+        for fk in table.foreign_keys:
+            to = ", ".join(quote_name(c) for c in fk.to if c is not None)
+            defs.append(f'FOREIGN KEY ({", ".join(map(quote_name, fk.cols))}) REFERENCES {quote_name(fk.table)}' + (f" ({to})" if to else ""))
+        for c, lk in lookups.items():
+            defs.append(f'FOREIGN KEY ({quote_name(c)}) REFERENCES {quote_name(lk)} (id)')
+
+        select = []
+        view = []
+        select_joins = []
+        view_joins = []
+        for i, c in enumerate(table.cols):
+            q = quote_name(c)
+            if c in lookups:
+                lk = quote_name(lookups[c])
+                select.append(f'l{i}.id')
+                view.append(f'l{i}.value AS {q}')
+                select_joins.append(f' LEFT JOIN {lk} l{i} ON l{i}.value = t.{q} COLLATE BINARY')
+                view_joins.append(f' LEFT JOIN {lk} l{i} ON l{i}.id = t.{q}')
+            else:
+                select.append(f't.{q}')
+                view.append(f't.{q}')
+
+        self.execute(f'CREATE TABLE {quote_name(data)} ({", ".join(defs)}){get_table_options(table.sql)};')
+        self.execute(f'INSERT INTO {quote_name(data)} SELECT {", ".join(select)} FROM {quote_name(table.name)} t{"".join(select_joins)};')
+        self.execute(f'DROP TABLE {quote_name(table.name)};')
+        for ix in table.indexes:
+            if ix.origin == 'c':
+                unique = "UNIQUE " if ix.unique else ""
+                self.execute(f'CREATE {unique}INDEX {quote_name(ix.name)} ON {quote_name(data)} ({", ".join(map(quote_name, ix.cols))});')
+        self.execute(f'CREATE VIEW {quote_name(table.name)} AS SELECT {", ".join(view)} FROM {quote_name(data)} t{"".join(view_joins)};')
+        rows = self.one(f"select count(*) from {quote_name(data)}")
+        return tuple(Encoding(table=table.name, column=c, lookup=lookups[c], values=d, rows=rows) for c, d in cols)
+
+
 class MEMLite(DBLite):
+    def __init__(
+            self,
+            file: str,
+            *args,
+            out: Union[None, str] = None,
+            memory_mb: Union[None, int] = MEMORY_MB,
+            sniff: bool = False,
+            **kwargs
+    ):
+        self.__out = out
+        self.__memory_mb = memory_mb
+        self.__sniff = sniff
+        self.__target = MEMORY
+        self.__temp: Union[None, str] = None
+        super().__init__(file, *args, **kwargs)
+
+    @property
+    def target(self) -> str:
+        return self.__target
+
+    def __get_target(self, file: str):
+        if self.__memory_mb is None or not isfile(file):
+            return MEMORY
+        size = getsize(file)
+        if file.rsplit(".", 1)[-1].lower() in COMPRESS:
+            size = size * COMPRESS_RATIO
+        if size <= self.__memory_mb * 1024 * 1024:
+            return MEMORY
+        if self.__out is not None and not isfile(self.__out):
+            return self.__out
+        # sqlite trata un fichero vacío como una base de datos nueva
+        fd, self.__temp = tempfile.mkstemp(suffix=".sqlite", prefix="memlite_")
+        close_fd(fd)
+        return self.__temp
 
     def _connect(self, file: str):
-        ext = self.__get_ext(file)
-        cnt = getattr(self, "_connect_" + ext, super()._connect)
-        src = cnt(file)
         if file == MEMORY:
-            return src
-        con = sqlite3.connect(MEMORY)
-        src.backup(con)
-        src.close()
+            return super()._connect(file)
+        self.__target = self.__get_target(file)
+        if self.__target != MEMORY:
+            logger.info(f"sqlite: {file} -> {self.__target}")
+        con = sqlite3.connect(self.__target)
+        if self.__target != MEMORY:
+            # es un fichero nuevo, si la carga falla se borra
+            con.execute("PRAGMA journal_mode=MEMORY")
+            con.execute("PRAGMA synchronous=OFF")
+        try:
+            cnt = getattr(self, "_connect_" + self.__get_ext(file), None)
+            if cnt is not None:
+                cnt(file, con)
+            else:
+                src = super()._connect(file)
+                src.backup(con)
+                src.close()
+        except BaseException:
+            con.close()
+            self.__remove_target()
+            raise
         return con
 
+    def __remove_target(self):
+        if self.__target != MEMORY and isfile(self.__target):
+            remove(self.__target)
+        self.__temp = None
+
+    def close(self, vacuum=True):
+        if self.__temp is None:
+            return super().close(vacuum=vacuum)
+        try:
+            super().close(vacuum=False)
+        finally:
+            self.__remove_target()
+
     def __get_ext(self, file: str) -> str:
         ext = file.rsplit(".", 1)[-1]
         ext = ext.lower()
+        if ext in COMPRESS:
+            return self.__get_ext(file[:-len(ext)-1])
         return {
             "accdb": "mdb",
             "xlsx": "xls",
         }.get(ext, ext)
 
-    def _connect_mdb(self, file: str):
+    def _connect_mdb(self, file: str, con: sqlite3.Connection):
         def __get_schema():
             schema = Shell.get("mdb-schema", file, "sqlite")
             for line in schema.split("\n"):
@@ -169,8 +947,6 @@ class MEMLite(DBLite):
                     return Shell.get("mdb-schema", "--no-relations", file, "sqlite")
             return schema
 
-        con = sqlite3.connect(MEMORY)
-
         schema = __get_schema()
         schema = re.sub(r"\bvarchar($|,)", r"TEXT\1", schema, flags=re.MULTILINE)
         con.executescript(schema)
@@ -184,9 +960,7 @@ class MEMLite(DBLite):
                 con.executescript(output)
                 con.commit()
 
-        return con
-
-    def _connect_xls(self, file: str):
+    def _connect_xls(self, file: str, con: sqlite3.Connection):
         name = basename(file).rsplit(".", 1)[0]
 
         def __normalize_col(c: str):
@@ -194,6 +968,8 @@ class MEMLite(DBLite):
                 c = str(c)
             return normalize_name(c, prefix='c')
 
+        import pandas as pd
+
         def __read_data():
             obj: Dict[str, pd.DataFrame] = {}
             sheets = list(pd.ExcelFile(file).sheet_names)
@@ -215,46 +991,101 @@ class MEMLite(DBLite):
                 data.columns = tuple(map(__normalize_col, data.columns))
                 return data
 
-        con = sqlite3.connect(MEMORY)
         data = __read_data()
         for k, df in data.items():
             name = normalize_name(k, prefix="t")
             df.to_sql(name=name, index=False, con=con)
-        return con
 
-    def _connect_csv(self, file: str):
+    def _connect_csv(self, file: str, con: sqlite3.Connection):
+        import pandas as pd
+
+        options = sniff_csv(file, delimiter=self.__sniff)
+
         def __normalize_col(c: str):
             return normalize_name(c, prefix='c')
 
-        def __read_data():
+        def __find_header():
             skiprows = 0
             while True:
-                data = pd.read_csv(file, skiprows=skiprows)
+                data = pd.read_csv(file, skiprows=skiprows, nrows=CSV_HEADER_ROWS, **options)
                 for c in data.columns:
                     if not re.match(r"^Unnamed: \d+$", c):
-                        data.columns = tuple(map(__normalize_col, data.columns))
-                        return data
+                        return skiprows
                 skiprows = skiprows + 1
 
-        name = basename(file).rsplit(".", 1)[0]
-        name = normalize_name(name, prefix="t")
-        data = __read_data()
+        def __get_kind(values: pd.Series):
+            # el tipo que pandas daría a la columna al leer solo este bloque
+            data = values.dropna()
+            if data.empty:
+                return None
+            if data.isin(CSV_TRUE + CSV_FALSE).all():
+                return "BOOLEAN"
+            data = pd.to_numeric(data, errors="coerce")
+            if data.isna().any():
+                return "TEXT"
+            if data.dtype.kind in "iu" and len(data) == len(values):
+                return "INTEGER"
+            return "REAL"
 
-        con = sqlite3.connect(MEMORY)
+        def __get_type(kinds: set):
+            if kinds == {"INTEGER"}:
+                return "INTEGER"
+            if kinds - {None} == {"BOOLEAN"}:
+                return "BOOLEAN"
+            if kinds <= {"INTEGER", "REAL", None}:
+                return "REAL"
+            return "TEXT"
 
-        data.to_sql(name=name, index=False, con=con)
+        def __cast(c: str, tp: str):
+            q = quote_name(c)
+            if tp == "BOOLEAN":
+                true = ", ".join("'" + v + "'" for v in CSV_TRUE)
+                false = ", ".join("'" + v + "'" for v in CSV_FALSE)
+                return f"CASE WHEN {q} IN ({true}) THEN 1 WHEN {q} IN ({false}) THEN 0 END"
+            if tp == "TEXT":
+                return q
+            return f"CAST({q} AS {tp})"
 
-        return con
+        name = basename(file).rsplit(".", 1)[0]
+        name = normalize_name(name, prefix="t")
+        skiprows = __find_header()
+        sample = pd.read_csv(file, skiprows=skiprows, nrows=0, **options)
+        columns = tuple(map(__normalize_col, sample.columns))
+        # todo se lee como texto y el tipo de cada columna se decide al final,
+        # con todos los bloques vistos (un '007' solo es 7 si toda la columna es numérica)
+        sample.columns = columns
+        sample.to_sql(name=name, index=False, con=con, dtype={c: "TEXT" for c in columns})
+        kinds = {c: set() for c in columns}
+        for chunk in pd.read_csv(file, skiprows=skiprows, chunksize=CSV_CHUNK_ROWS, dtype=str, **options):
+            chunk.columns = columns
+            for c in columns:
+                kinds[c].add(__get_kind(chunk[c]))
+            chunk.to_sql(name=name, index=False, con=con, if_exists="append")
+        types = {c: __get_type(k) for c, k in kinds.items()}
+        if all(tp == "TEXT" for tp in types.values()):
+            return
+        tmp = "TMP_" + name
+        defs = ", ".join(f'{quote_name(c)} {"INTEGER" if tp == "BOOLEAN" else tp}' for c, tp in types.items())
+        values = ", ".join(__cast(c, tp) for c, tp in types.items())
+        con.execute(f'CREATE TABLE {quote_name(tmp)} ({defs})')
+        con.execute(f'INSERT INTO {quote_name(tmp)} SELECT {values} FROM {quote_name(name)}')
+        con.execute(f'DROP TABLE {quote_name(name)}')
+        con.execute(f'ALTER TABLE {quote_name(tmp)} RENAME TO {quote_name(name)}')
+        con.commit()
 
-    def _connect_zip(self, file: str):
-        con = sqlite3.connect(MEMORY)
+    def _connect_zip(self, file: str, con: sqlite3.Connection):
         for f in iter_zip(file):
-            with MEMLite(f) as db:
+            with MEMLite(f, memory_mb=self.__memory_mb, sniff=self.__sniff) as db:
                 db.backup(con)
-        return con
 
-    def _connect_sql(self, file: str):
-        con = sqlite3.connect(MEMORY)
-        with open(file, "r") as f:
-            con.executescript(f.read())
-        return con
+    def _connect_sql(self, file: str, con: sqlite3.Connection):
+        def __iter_lines():
+            # un solo flujo para todas las partes: una sentencia puede seguir en la siguiente
+            for part in find_sql_parts(file):
+                with open_sql(part) as f:
+                    yield from f
+
+        con.isolation_level = None
+        for sql in iter_sql_statements(__iter_lines()):
+            con.execute(sql)
+        con.isolation_level = ""
@@ -7,7 +7,6 @@ from base64 import b64encode
 import re
 from core.shell import Shell
 import logging
-from PIL import Image
 from core.github import GitHub
 from core.filemanager import FileManager
 from core.dblite import DBLite
@@ -203,6 +202,7 @@ class SchemasPy:
                 f.write(svg)
             return
         if ext == "png":
+            from PIL import Image
             im = Image.open(fl)
             box = im.getbbox()
             box = list(box)
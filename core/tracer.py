@@ -0,0 +1,140 @@
+import json
+import logging
+import re
+import sqlite3
+from dataclasses import dataclass, asdict, field
+from time import perf_counter
+from typing import Dict, List, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+re_literal = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+re_space = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str):
+    sql = re_literal.sub("?", sql)
+    sql = re_space.sub(" ", sql)
+    return sql.strip()
+
+
+@dataclass
+class QueryStat:
+    sql: str
+    count: int = 0
+    traced: int = 0
+    time: float = 0
+    max_time: float = 0
+    rows: int = 0
+    changes: int = 0
+    steps: int = 0
+    plan: Tuple[str, ...] = field(default_factory=tuple)
+
+
+class SqlTracer:
+    def __init__(
+            self,
+            con: sqlite3.Connection,
+            threshold: float = 1.0,
+            log: Union[None, str] = None,
+            progress_steps: int = 1000
+    ):
+        self.__con = con
+        self.threshold = threshold
+        self.log = log
+        self.progress_steps = progress_steps
+        self.stats: Dict[str, QueryStat] = {}
+        self.__steps = 0
+        self.__con.set_trace_callback(self.__on_trace)
+        self.restore_progress()
+
+    def restore_progress(self):
+        # la conexión solo tiene un progress handler: se vuelve a poner
+        # después de que otro (p.e. el de VACUUM INTO) lo sustituya
+        if self.progress_steps > 0:
+            self.__con.set_progress_handler(self.__on_progress, self.progress_steps)
+        else:
+            self.__con.set_progress_handler(None, 0)
+
+    def close(self):
+        self.__con.set_trace_callback(None)
+        self.__con.set_progress_handler(None, 0)
+
+    def __on_trace(self, sql: str):
+        self.__get_stat(sql).traced += 1
+
+    def __on_progress(self):
+        self.__steps = self.__steps + self.progress_steps
+        return 0
+
+    def __get_stat(self, sql: str):
+        key = normalize_sql(sql)
+        stat = self.stats.get(key)
+        if stat is None:
+            stat = QueryStat(sql=key)
+            self.stats[key] = stat
+        return stat
+
+    def start(self):
+        return (perf_counter(), self.__con.total_changes, self.__steps)
+
+    def end(self, token: Tuple[float, int, int], sql: str, args: Tuple = tuple(), rows: int = 0, explain=True):
+        elapsed = perf_counter() - token[0]
+        changes = self.__con.total_changes - token[1]
+        steps = self.__steps - token[2]
+        stat = self.__get_stat(sql)
+        stat.count += 1
+        stat.time += elapsed
+        stat.max_time = max(stat.max_time, elapsed)
+        stat.rows += rows
+        stat.changes += changes
+        stat.steps += steps
+        if elapsed < self.threshold:
+            return
+        plan = self.explain(sql, args) if explain else tuple()
+        if plan:
+            stat.plan = plan
+        logger.warning(f"slow query {elapsed:.3f}s: {stat.sql}" + "".join("\n  " + p for p in plan))
+        if self.log:
+            with open(self.log, "a") as f:
+                f.write(json.dumps(dict(
+                    sql=sql,
+                    time=elapsed,
+                    rows=rows,
+                    changes=changes,
+                    steps=steps,
+                    plan=plan
+                ), default=str) + "\n")
+
+    def explain(self, sql: str, args: Tuple = tuple()) -> Tuple[str, ...]:
+        self.__con.set_trace_callback(None)
+        try:
+            cursor = self.__con.execute("EXPLAIN QUERY PLAN " + sql, args)
+            return tuple(r[-1] for r in cursor.fetchall())
+        except (sqlite3.Error, ValueError):
+            return tuple()
+        finally:
+            self.__con.set_trace_callback(self.__on_trace)
+
+    def get_stats(self) -> List[QueryStat]:
+        return sorted(self.stats.values(), key=lambda s: (-s.time, -s.traced))
+
+    def report(self, limit: int = 20):
+        line_fmt = "| {time:>9} | {count:>8} | {traced:>7} | {rows:>9} | {changes:>9} | {steps:>10} | {sql} |"
+        lines = [
+            line_fmt.format(time="Tiempo", count="Llamadas", traced="Trazas", rows="Filas", changes="Cambios", steps="Pasos", sql="SQL"),
+            line_fmt.format(time=":", count=":", traced=":", rows=":", changes=":", steps=":", sql=":")
+            .replace("| :", "|: ")
+            .replace(": |", " :|")
+            .replace(" ", "-")
+        ]
+        for s in self.get_stats()[:limit]:
+            d = asdict(s)
+            d['time'] = f"{s.time:.3f}"
+            lines.append(line_fmt.format(**d))
+        return "\n".join(lines)
+
+    def dump(self, file: str):
+        with open(file, "w") as f:
+            for s in self.get_stats():
+                f.write(json.dumps(asdict(s), default=str) + "\n")
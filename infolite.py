@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from os.path import isfile, basename
-from core.dblite import DBLite
+from core.dblite import DBLite, readonly_mode, sql_isdigit
 import sys
 import argparse
 from textwrap import dedent
@@ -9,10 +9,9 @@ from typing import Dict, Union
 
 
 class InfoDBLite(DBLite):
-    def __init__(self, *args, **kwargs):
-        kwargs['readonly'] = True
-        super().__init__(*args, **kwargs)
-        self.register_function("isdigit", 1, lambda s: s.isdigit())
+    def __init__(self, file: str, *args, **kwargs):
+        kwargs['readonly'] = readonly_mode(file)
+        super().__init__(file, *args, **kwargs)
 
     def describe(self, table: str, col: str) -> Dict[str, Union[str, int]]:
         r = dict(
@@ -31,7 +30,8 @@ class InfoDBLite(DBLite):
             elif r['type'] == 'integer':
                 r['type'] = 'int'
             elif r['type'] == 'text':
-                if self.one(f'select count(*) from "{table}" where not("{col}" is null or "{col}"=\'\') and not isdigit("{col}")') == 0:
+                isdigit = sql_isdigit(f'"{col}"')
+                if self.one(f'select count(*) from "{table}" where not("{col}" is null or "{col}"=\'\') and not {isdigit}') == 0:
                     r['type'] = 'int?'
         for k, v in list(r.items()):
             if isinstance(v, float):
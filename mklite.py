@@ -6,7 +6,8 @@ import sys
 import argparse
 from typing import Dict
 from textwrap import dedent
-from core.mklite import MEMLite, NormLite
+from core.mklite import MEMLite, NormLite, Constraint, Encoding, Compaction, MEMORY_MB
+from core.dblite import COMPRESS
 from typing import NamedTuple, Tuple, List
 
 import logging
@@ -35,8 +36,8 @@ class Resume(NamedTuple):
 
 
 class SourceLite(MEMLite):
-    def __init__(self, src: Source):
-        super().__init__(src.file)
+    def __init__(self, src: Source, **kwargs):
+        super().__init__(src.file, **kwargs)
         self.src = src
         self.exclude = ()
         self.selected_tables = ()
@@ -78,7 +79,12 @@ if __name__ == "__main__":
     parser.add_argument('--verbose', '-v', action='count', help="Nivel de depuración", default=0)
     parser.add_argument('--sql', action='store_true', help="Guardar script sql")
     parser.add_argument('--normalize', action='store_true', help='Renombrar tablas y columnas para normalizarlas')
+    parser.add_argument('--compact', action='store_true', help='Normalizar generando tablas STRICT (y WITHOUT ROWID si hay clave natural) con el tamaño de página adecuado')
+    parser.add_argument('--index', action='store_true', help='Detectar y crear claves primarias, únicas, ajenas e índices')
+    parser.add_argument('--encode', action='store_true', help='Mover columnas de texto repetitivas a tablas auxiliares (la tabla original pasa a ser una vista)')
     parser.add_argument('--out', help="Fichero de salida")
+    parser.add_argument('--sniff', action='store_true', help="Detectar el separador de los csv (por defecto ',')")
+    parser.add_argument('--memory', type=int, default=MEMORY_MB, help=f"Memoria en MB para cargar cada fuente, las que no quepan se cargan directamente en disco (por defecto {MEMORY_MB})")
 
     parser.add_argument('files', nargs='+',
         help=dedent(
@@ -133,6 +139,8 @@ if __name__ == "__main__":
         flag, word = parse_file(file)
         if flag is True:
             ext = file.split(".")[-1].lower()
+            if ext in COMPRESS:
+                ext = file.split(".")[-2].lower()
             if ext not in EXT:
                 sys.exit(file + " tiene una extension no valida ({})".format(", ".join(EXT)))
             files[file] = Source(file=file)
@@ -162,16 +170,26 @@ if __name__ == "__main__":
         sys.exit(pargs.out + " ya existe")
 
     resume: List[Resume] = []
+    keys: Tuple[Constraint, ...] = tuple()
+    encoded: Tuple[Encoding, ...] = tuple()
+    compacted: Tuple[Compaction, ...] = tuple()
+    with SourceLite(sources[0], out=pargs.out, memory_mb=pargs.memory, sniff=pargs.sniff) as s:
+        if s.target != pargs.out:
+            s.backup(pargs.out)
+        resume.append(s.get_resumen())
     with NormLite(pargs.out) as db:
-        with SourceLite(sources[0]) as s:
-            s.backup(db)
-            resume.append(s.get_resumen())
-        for src in sources[1:]:
-            with SourceLite(src) as s:
-                db.executescript("\n".join(s.iter_sql_backup()))
-                resume.append(s.get_resumen())
-        if pargs.normalize:
-            db.normalize()
+        with db.bulk_load():
+            for src in sources[1:]:
+                with SourceLite(src, memory_mb=pargs.memory, sniff=pargs.sniff) as s:
+                    db.executescript("\n".join(s.iter_sql_backup()))
+                    resume.append(s.get_resumen())
+        if pargs.normalize or pargs.compact:
+            compacted = db.normalize(compact=pargs.compact)
+            page_size = db.one("PRAGMA page_size")
+        if pargs.index:
+            keys = db.create_keys()
+        if pargs.encode:
+            encoded = db.encode()
         if pargs.sql:
             with open(pargs.out+".sql", "w") as f:
                 for ln in db.iter_sql_backup():
@@ -184,3 +202,19 @@ if __name__ == "__main__":
                 print(f"    * ~~{s}~~")
             else:
                 print(f"    * {s}")
+    if pargs.compact:
+        print(f"* Compactación (page_size={page_size})")
+        for c in compacted:
+            print("    * " + str(c).replace("~", "\\~"))
+    if pargs.index:
+        print("* Claves e índices creados")
+        for k in keys:
+            print("    * " + str(k).replace("~", "\\~"))
+        if len(keys) == 0:
+            print("    * Ninguno")
+    if pargs.encode:
+        print("* Columnas codificadas")
+        for e in encoded:
+            print("    * " + str(e).replace("~", "\\~"))
+        if len(encoded) == 0:
+            print("    * Ninguna")
@@ -5,7 +5,7 @@ from core.filemanager import FileManager
 import pandas as pd
 import sqlite3
 from typing import List
-from core.dblite import DBLite, dict_factory
+from core.dblite import DBLite, readonly_mode
 import logging
 import sys
 from typing import Dict, Any
@@ -31,9 +31,11 @@ def read_sql(sql: str, db: DBLite, size=100):
         pass
     dfs: List[pd.DataFrame] = []
     r: Dict[str, Any]
-    for r in db.select(sql, row_factory=dict_factory):
-        aux = pd.DataFrame(r.values(), columns=r.keys())
+    for r in db.select_columnar(sql):
+        aux = pd.DataFrame(r)
         dfs.append(aux)
+    if len(dfs) == 0:
+        return pd.DataFrame(columns=db.get_cols(sql))
     df = pd.concat(dfs, ignore_index=True)
     return df
 
@@ -66,7 +68,7 @@ if __name__ == "__main__":
     )
 
     FM = FileManager(root=getcwd())
-    with DBLite(pargs.db, readonly=True) as db:
+    with DBLite(pargs.db, readonly=readonly_mode(pargs.db)) as db:
         for path in iter_sql_files(pargs.sql):
             if path.split("/")[-1][0] == "_":
                 continue
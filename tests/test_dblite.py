@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from core.dblite import DBLite, EmptyUpSertException
+
+
+def test_memoize_keeps_int_and_real_apart():
+    with DBLite() as db:
+        db.register_function("tp", 2, lambda x, y: type(x).__name__, memoize=100)
+        db.execute("create table t (x)")
+        db.execute("insert into t values (1), (1.0)")
+        assert db.to_tuple("select tp(x, 'a') from t order by rowid") == ('int', 'float')
+
+
+def make_db():
+    db = DBLite()
+    db.execute("create table t (id integer primary key, name text unique, qty int default 0 not null, note text)")
+    return db
+
+
+def test_insert_many_applies_defaults():
+    with make_db() as db:
+        rows = [
+            {"name": "a", "qty": None},
+            {"name": "b", "qty": 5, "note": ""},
+            {"name": "c", "qty": 7, "note": "x"},
+        ]
+        assert db.insert_many("t", rows) == 3
+        assert db.insert_many("t", [(4, "d", None, None)], cols=("id", "name", "qty", "note")) == 1
+        assert db.to_tuple("select name, qty, note from t order by id") == (
+            ("a", 0, None), ("b", 5, None), ("c", 7, "x"), ("d", 0, None)
+        )
+
+
+def test_insert_many_without_skip_null():
+    with make_db() as db:
+        db.insert_many("t", [{"name": "a", "qty": 1, "note": None}], skip_null=False)
+        with pytest.raises(sqlite3.IntegrityError):
+            db.insert_many("t", [{"name": "b", "qty": None}], skip_null=False)
+
+
+def test_upsert_many():
+    with make_db() as db:
+        db.insert_many("t", [{"name": "a", "qty": 1, "note": "uno"}, {"name": "b", "qty": 2, "note": "dos"}])
+        rows = [{"name": "a", "qty": 10, "note": None}, {"name": "c", "qty": 3, "note": "tres"}]
+        assert db.upsert_many("t", rows, conflict_cols="name") == 2
+        assert db.to_tuple("select name, qty, note from t order by id") == (
+            ("a", 10, "uno"), ("b", 2, "dos"), ("c", 3, "tres")
+        )
+        db.upsert_many("t", [("b", 20, None)], conflict_cols="name", update_cols=("qty", "note"), cols=("name", "qty", "note"))
+        assert db.to_tuple("select qty, note from t where name = 'b'") == ((20, "dos"), )
+        with pytest.raises(EmptyUpSertException):
+            db.upsert_many("t", [{"name": "a", "qty": 1}], conflict_cols="name", update_cols="note")
+
+
+def test_vacuum_progress_keeps_tracer(tmp_path):
+    with DBLite(str(tmp_path / "datos.sqlite")) as db:
+        db.execute("create table t (a int)")
+        db.insert_many("t", ((i, ) for i in range(1000)), cols=("a", ))
+        db.commit()
+        tracer = db.start_trace(progress_steps=10)
+        db.backup(str(tmp_path / "copia.sqlite"), vacuum=True, progress=lambda p: None)
+        assert db.one("select sum(a) from t where a % 3 = 0") == sum(range(0, 1000, 3))
+        assert any(s.steps > 0 for s in tracer.get_stats())
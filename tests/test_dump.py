@@ -0,0 +1,50 @@
+import sqlite3
+
+import pytest
+
+from core.dblite import DBLite
+
+SCHEMA = '''
+create table "a b" (id integer primary key autoincrement, "x""y" text, v real, b blob);
+insert into "a b" ("x""y", v, b) values ('uno', 1.5, x'00ff'), ('dos
+lineas', null, null), ('VALUES ('')', -2, x'');
+delete from "a b" where id = 2;
+create table p (id int primary key, a_id int references "a b"(id));
+insert into p values (1, 1), (2, 3);
+create index ix_p on p (a_id);
+create view vp as select * from p;
+create trigger tp after insert on p begin
+    insert into "a b" ("x""y") values ('trigger;
+');
+end;
+create virtual table f using fts5(body);
+insert into f values ('hola mundo'), ('adios');
+'''
+
+
+def dump_rows(file: str):
+    with sqlite3.connect(file) as con:
+        master = sorted(con.execute("select type, name, sql from sqlite_master"))
+        rows = {}
+        for tp, name, _ in master:
+            if tp == 'table' and name != 'f':
+                rows[name] = sorted(con.execute(f'select * from "{name.replace(chr(34), chr(34) * 2)}"'), key=repr)
+        return master, rows
+
+
+@pytest.mark.parametrize("width_values, multiple_limit", [(-1, -1), (20, -1), (-1, 1), (40, 2)])
+def test_round_trip(tmp_path, width_values, multiple_limit):
+    src = str(tmp_path / "src.sqlite")
+    dst = str(tmp_path / "dst.sqlite")
+    with sqlite3.connect(src) as con:
+        con.executescript(SCHEMA)
+    with DBLite(src, readonly=True) as db:
+        lines = tuple(db.iter_sql_backup(width_values=width_values, multiple_limit=multiple_limit))
+    with DBLite(dst) as db:
+        db.executescript("\n".join(lines))
+    assert dump_rows(dst) == dump_rows(src)
+    with sqlite3.connect(dst) as con:
+        assert con.execute("select body from f where f match 'hola'").fetchall() == [('hola mundo', )]
+        assert con.execute("select seq from sqlite_sequence where name = 'a b'").fetchone() == (3, )
+        con.execute('''insert into "a b" ("x""y") values ('nuevo')''')
+        assert con.execute('select max(id) from "a b"').fetchone() == (4, )
@@ -0,0 +1,78 @@
+import sqlite3
+
+import pytest
+
+import core.mklite
+from core.mklite import MEMLite, NormLite
+
+VIEW = "create view v as select m.nombre, p.nombre provincia from municipio m join provincia p on p.id = m.provincia"
+
+
+def make_db(file: str, *sqls: str):
+    with sqlite3.connect(file) as con:
+        con.execute("create table provincia (id integer, nombre text)")
+        con.execute("create table municipio (id integer, provincia integer, nombre text)")
+        con.executemany("insert into provincia values (?, ?)", ((i, f"p{i}") for i in range(1, 11)))
+        con.executemany("insert into municipio values (?, ?, ?)", ((i, i % 10 + 1, f"m{i}") for i in range(1, 201)))
+        for sql in sqls:
+            con.execute(sql)
+
+
+def get_table_sql(db: NormLite, table: str):
+    return db.one("select sql from sqlite_master where type = 'table' and name = ?", table)
+
+
+def test_create_keys_rebuilds_tables(tmp_path):
+    file = str(tmp_path / "datos.sqlite")
+    make_db(file)
+    with NormLite(file) as db:
+        keys = {str(c) for c in db.create_keys()}
+        assert "municipio: FOREIGN KEY (provincia) REFERENCES provincia (id)" in keys
+        assert "PRIMARY KEY" in get_table_sql(db, "provincia")
+        assert "REFERENCES" in get_table_sql(db, "municipio")
+        assert db.one("select count(*) from municipio") == 200
+        assert db.to_tuple("pragma foreign_key_check") == tuple()
+
+
+@pytest.mark.parametrize("sql", [
+    VIEW,
+    "create trigger tg after delete on provincia begin delete from municipio where provincia = old.id; end",
+])
+def test_create_keys_skips_referenced_tables(tmp_path, sql):
+    file = str(tmp_path / "datos.sqlite")
+    make_db(file, sql)
+    with NormLite(file) as db:
+        keys = tuple(db.create_keys())
+        assert not any(c.kind == "FOREIGN KEY" and c.created for c in keys)
+        assert "REFERENCES" not in get_table_sql(db, "municipio")
+        assert db.one("select count(*) from sqlite_master where type in ('view', 'trigger')") == 1
+    with NormLite(file) as db:
+        assert all(not c.created for c in db.create_keys())
+
+
+def test_compact_skips_referenced_tables(tmp_path):
+    file = str(tmp_path / "datos.sqlite")
+    make_db(file, "create view v as select nombre from municipio")
+    with NormLite(file) as db:
+        compacted = {c.table: c for c in db.normalize(compact=True)}
+        assert not compacted["municipio"].compacted
+        assert compacted["provincia"].compacted
+        assert get_table_sql(db, "provincia").endswith("STRICT")
+        assert db.one("select count(*) from v") == 200
+
+
+@pytest.mark.parametrize("chunk_rows", [50000, 100])
+def test_csv_types_use_every_chunk(tmp_path, monkeypatch, chunk_rows):
+    monkeypatch.setattr(core.mklite, "CSV_CHUNK_ROWS", chunk_rows)
+    file = str(tmp_path / "datos.csv")
+    with open(file, "w") as f:
+        f.write("codigo,n,x,b,vacio\n")
+        for i in range(400):
+            codigo = f"{i:03d}" if i < 300 else f"X{i}"
+            x = "" if i == 350 else f"{i / 4}"
+            f.write(f"{codigo},{i},{x},{i % 2 == 1},\n")
+    with MEMLite(file) as db:
+        types = {c: t for _, c, t, *_ in db.select("pragma table_info(datos)")}
+        assert types == {"codigo": "TEXT", "n": "INTEGER", "x": "REAL", "b": "INTEGER", "vacio": "REAL"}
+        assert db.to_tuple("select codigo from datos where rowid in (8, 400)") == ("007", "X399")
+        assert db.one("select sum(n) from datos where b = 1") == sum(range(1, 400, 2))
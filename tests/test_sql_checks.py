@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from core.dblite import sql_can_be_int, sql_isdigit
+
+
+def py_can_be_int(s):
+    # el can_be_int() que se registraba como UDF antes de pasarlo a SQL
+    if s is None:
+        return True
+    if isinstance(s, float):
+        return int(s) == s
+    if isinstance(s, int):
+        return True
+    if not isinstance(s, str):
+        return False
+    return s.isdigit()
+
+
+def py_isdigit(s):
+    return isinstance(s, str) and s.isdigit()
+
+
+VALUES = (
+    None, 0, 1, -1, 2**62, -2**63, 2**63 - 1,
+    0.0, -0.0, 1.0, -1.0, 1.5, -1.5, 1e15, 1e15 + 0.5, 4503599627370497.0,
+    1e19, -1e19, 1e300, 1e-300, 2.0**63,
+    "", " ", "0", "007", "12", "-1", "+1", "1.0", "1e3", " 1", "1 ", "abc",
+    "12a", "a12", "0x10", "\n", "9" * 40, "ñ",
+    b"", b"12", b"\x00",
+)
+INFINITE = (float("inf"), float("-inf"))
+UNICODE_DIGITS = ("٣", "²", "１２", "১২")
+
+
+def sql_check(sql, value):
+    with sqlite3.connect(":memory:") as con:
+        return bool(con.execute(f"select {sql('v')} from (select ? as v)", (value, )).fetchone()[0])
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_can_be_int(value):
+    assert sql_check(sql_can_be_int, value) == py_can_be_int(value)
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_isdigit(value):
+    assert sql_check(sql_isdigit, value) == py_isdigit(value)
+
+
+@pytest.mark.parametrize("value", INFINITE, ids=repr)
+def test_infinite_is_not_int(value):
+    with pytest.raises(OverflowError):
+        py_can_be_int(value)
+    assert sql_check(sql_can_be_int, value) is False
+
+
+@pytest.mark.parametrize("value", UNICODE_DIGITS, ids=repr)
+def test_only_ascii_digits(value):
+    assert py_isdigit(value) and py_can_be_int(value)
+    assert sql_check(sql_isdigit, value) is False
+    assert sql_check(sql_can_be_int, value) is False
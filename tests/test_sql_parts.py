@@ -0,0 +1,63 @@
+import sqlite3
+
+import pytest
+
+from core.dblite import DBLite, find_sql_parts
+from core.mklite import MEMLite
+
+SCHEMA = '''
+create table t (id integer primary key, v text);
+insert into t (v) values ('uno'), ('dos;
+tres'), ('cuatro');
+create table log (msg text);
+create trigger tt after update on t begin
+    insert into log values ('a;');
+    insert into log values ('b;');
+end;
+'''
+
+
+def make_db(file: str, schema: str = SCHEMA):
+    with sqlite3.connect(file) as con:
+        con.executescript(schema)
+
+
+@pytest.mark.parametrize("compress", [None, "gz"])
+@pytest.mark.parametrize("per_table", [False, True])
+def test_split_round_trip(tmp_path, compress, per_table):
+    src = str(tmp_path / "datos.sqlite")
+    make_db(src)
+    with DBLite(src) as db:
+        files = db.sql_backup(compress=compress, part_size=10, per_table=per_table)
+    assert len(files) > 1
+    with MEMLite(files[0]) as db:
+        assert db.to_tuple("select v from t order by id") == ('uno', 'dos;\ntres', 'cuatro')
+        assert db.one("select count(*) from sqlite_master where type = 'trigger'") == 1
+        db.execute("update t set v = v where id = 1")
+        assert db.to_tuple("select msg from log") == ('a;', 'b;')
+
+
+def test_parts_do_not_clash_with_dates(tmp_path):
+    for year in (2023, 2024):
+        src = str(tmp_path / f"datos.{year}.sqlite")
+        make_db(src, f"create table t{year} (a int); insert into t{year} values ({year});")
+        with DBLite(src) as db:
+            db.sql_backup()
+    file = str(tmp_path / "datos.2023.sql")
+    assert find_sql_parts(file) == (file, )
+    with MEMLite(file) as db:
+        assert db.tables == ('t2023', )
+
+
+def test_semicolons_in_values(tmp_path):
+    src = str(tmp_path / "datos.sqlite")
+    values = tuple(f"a;b '{i}'; -- c /* ;\n;x" for i in range(2000))
+    with sqlite3.connect(src) as con:
+        con.execute("create table t (id integer primary key, v text)")
+        con.executemany("insert into t (v) values (?)", ((v, ) for v in values))
+    with DBLite(src) as db:
+        files = db.sql_backup(part_size=20000)
+    assert len(files) > 1
+    assert max(len(open(f).read()) for f in files) < 25000
+    with MEMLite(files[0]) as db:
+        assert db.to_tuple("select v from t order by id") == values